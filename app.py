@@ -1,55 +1,78 @@
 from flask import Flask
+from flask.cli import with_appcontext
 from flask_sqlalchemy import SQLAlchemy
 from flask_bootstrap import Bootstrap
 from flask_babelex import Babel
 from config import Config
 from flask_migrate import Migrate
+import click
+import db_setup
 
+# Extensions, bound to the application by create_app
+babel = Babel()
+# Patching flask-babelex
 
-app = Flask(__name__)
-app.config.from_object(Config)
+bootstrap = Bootstrap()
+db = SQLAlchemy()
+migrate = Migrate()
 
-babel = Babel(app)
-# Patching flask-babelex
 
-Bootstrap(app)
+def create_app(config=Config):
+    """
+    Create the application. Nothing is read from nor written to the
+    database: create it with flask init-db.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    babel.init_app(app)
+    bootstrap.init_app(app)
+    db_setup.init_app(app)
+    db.init_app(app)
+    migrate.init_app(app, db)
+
+    from auth import User, CustomUserManager
+    CustomUserManager(app, db, User)
+
+    import auth
+    app.register_blueprint(auth.bp)
+
+    import books
+    app.register_blueprint(books.bp)
+    app.add_url_rule('/', endpoint='books.index')
+
+    import labels
+    app.register_blueprint(labels.bp)
 
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+    import rentals
+    app.register_blueprint(rentals.bp)
 
-from auth import User, CustomUserManager
-user_manager = CustomUserManager(app,db,User)
+    import metrics
+    metrics.init_app(app)
 
-import auth
-app.register_blueprint(auth.bp)
+    import navbar
+    navbar.init_app(app)
 
-import books
-app.register_blueprint(books.bp)
-app.add_url_rule('/', endpoint='books.index')
+    app.cli.add_command(init_db_command)
+    return app
 
-from navbar import nav
-nav.init_app(app)
 
-db.create_all()
+def init_db():
+    """
+    Create the missing tables, the full-text index of the books and the
+    catalog version
+    """
+    import books
+    from search import create_search_index
 
-from auth import Role
-# Create 'member@example.com' user with no roles
-if not User.query.filter(User.username == 'user').first():
-        user = User(
-            username='user',
-            password=user_manager.hash_password('Password1'),
-        )
-        db.session.add(user)
-        db.session.commit()
+    db.create_all()
+    create_search_index()
+    books.init_catalog_version()
 
-    # Create 'admin@example.com' user with 'Admin' and 'Agent' roles
-if not User.query.filter(User.username == 'admin').first():
-        user = User(
-            username = 'admin',
-            password=user_manager.hash_password('Password1'),
-        )
-        user.roles.append(Role(name='Admin'))
-        user.roles.append(Role(name='Agent'))
-        db.session.add(user)
-        db.session.commit()
 
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the missing tables and indexes of the database."""
+    init_db()
+    click.echo('Database initialized')
@@ -1,18 +1,31 @@
 from app import db
-from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.urls import url_parse
 import functools
+import hashlib
 from flask import (
-        Blueprint, flash, g, redirect, render_template, request, session, url_for
+        Blueprint, Response, current_app, flash, g, redirect, render_template, request, session, url_for
         )
+from werkzeug.exceptions import abort
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired
 from wtforms import TextField, StringField, PasswordField, BooleanField, validators, SubmitField, SelectField
 from wtforms.validators import *
-from flask_table import Table, BoolCol, Col, ButtonCol 
+from flask_table import Table, BoolCol, Col, ButtonCol, LinkCol
 from languages import language_choices
+from barcodes import render_svg
+from exports import export_file, export_formats, export_response
+from pagination import SortableTable, paginate
+from passwords import PoolPasswordManager, rehashed_password
+import click
+import codecs
+import csv
+import secrets
 from flask_babelex import gettext, lazy_gettext
 from flask_babelex import refresh as babrefresh
 
+from sqlalchemy.orm import joinedload, make_transient_to_detached, selectinload
+from threading import Lock
+import time
 from sqlalchemy_utils import UUIDType
 import uuid
 from flask_user import UserManager, UserMixin, current_user, login_required, roles_required
@@ -33,12 +46,114 @@ class User(db.Model, UserMixin):
     roles = db.relationship('Role', secondary='user_roles')
 
     def set_password(self, password):
-        self.password = generate_password_hash(password)
+        self.password = current_app.user_manager.hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password, password)
-    
-    
+        return current_app.user_manager.verify_password(password, self.password)
+
+    # Role names, memoized for the lifetime of the instance (the request for
+    # current_user)
+    _role_names = None
+
+    def role_names(self):
+        if self._role_names is None:
+            self._role_names = frozenset(role.name for role in self.roles)
+        return self._role_names
+
+    def has_roles(self, *requirements):
+        """
+        Return True if the user has all the required roles, a tuple of roles
+        requiring any of them, like UserMixin.has_roles but without querying
+        the roles more than once
+        """
+        role_names = self.role_names()
+        for requirement in requirements:
+            if isinstance(requirement, (list, tuple)):
+                if not any(role_name in role_names for role_name in requirement):
+                    return False
+            elif requirement not in role_names:
+                return False
+        return True
+
+    @classmethod
+    def get_user_by_token(cls, token, expiration_in_seconds=None):
+        """
+        Load the user of a login token from the user cache, see UserMixin
+        """
+        user_manager = current_app.user_manager
+        data_items = user_manager.verify_token(token, expiration_in_seconds)
+        if not data_items:
+            return None
+
+        user_id = uuid.UUID(str(data_items[0]))
+        user = cached_user(user_id)
+        if user is not None and user.password[-8:] != data_items[1]:
+            # Another process may have changed the password since the user
+            # was cached, the token is only refused on the current one
+            db.session.expunge(user)
+            forget_users([user_id])
+            user = cached_user(user_id)
+        if user is None or user.password[-8:] != data_items[1]:
+            return None
+        return user
+
+
+# Identity and role names of the logged in users, keyed by user id, so that
+# loading current_user costs no query. Changes committed by this process
+# evict the user at once, other processes see them within USER_CACHE_TTL.
+user_cache = {}
+user_cache_lock = Lock()
+
+cached_columns = ('id', 'username', 'password', 'locale', 'active', 'first_name', 'last_name')
+
+def cached_user(user_id):
+    """
+    Return the user user_id attached to the session, built from the user
+    cache, or None if there is no such user
+    """
+    now = time.monotonic()
+    with user_cache_lock:
+        entry = user_cache.get(user_id)
+    if entry is None or entry[0] < now:
+        user = User.query.options(joinedload(User.roles)).get(user_id)
+        if user is None:
+            return None
+        entry = (now + current_app.config['USER_CACHE_TTL'],
+                 dict((column, getattr(user, column)) for column in cached_columns),
+                 user.role_names())
+        with user_cache_lock:
+            user_cache[user_id] = entry
+        return user
+
+    # Build a fresh instance per request, the cached state is never shared
+    user = User(**entry[1])
+    make_transient_to_detached(user)
+    user = db.session.merge(user, load=False)
+    user._role_names = entry[2]
+    return user
+
+def forget_users(user_ids):
+    with user_cache_lock:
+        for user_id in user_ids:
+            user_cache.pop(user_id, None)
+
+@db.event.listens_for(db.session, 'after_flush')
+def collect_changed_users(session, flush_context):
+    changed = session.info.setdefault('changed_users', set())
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.id)
+        elif isinstance(obj, UserRoles):
+            changed.add(obj.user_id)
+
+@db.event.listens_for(db.session, 'after_commit')
+def evict_changed_users(session):
+    forget_users(session.info.pop('changed_users', ()))
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_changed_users(session):
+    session.info.pop('changed_users', None)
+
 
 class Role(db.Model):
     __tablename__ = 'roles'
@@ -48,6 +163,9 @@ class Role(db.Model):
 
 class UserRoles(db.Model):
     __tablename__ = 'user_roles'
+    __table_args__ = (
+        db.Index('ix_user_roles_user_id_role_id', 'user_id', 'role_id', unique = True),
+    )
     id = db.Column(db.Integer, primary_key = True)
     user_id = db.Column(UUIDType, db.ForeignKey('users.id', ondelete='CASCADE'))
     role_id = db.Column(db.Integer(), db.ForeignKey('roles.id', ondelete='CASCADE'))
@@ -63,6 +181,9 @@ class UUIDLoginForm(FlaskForm):
     submit = SubmitField(lazy_gettext(u'Login'))
 
 class CustomUserManager(UserManager):
+    def customize(self, app):
+        self.password_manager = PoolPasswordManager(app)
+
     def login_view(self):
         """Prepare and process the login form."""
 
@@ -100,6 +221,12 @@ class CustomUserManager(UserManager):
                 user, user_email = self.db_manager.get_user_and_user_email_by_email(login_form.email.data)
 
             if user:
+                # Replace a password hash made with former settings
+                new_hash = rehashed_password(user.password)
+                if new_hash:
+                    user.password = new_hash
+                    db.session.commit()
+
                 # Log user in
                 safe_next_url = self.make_safe_url(login_form.next.data)
                 return self._do_login_user(user, safe_next_url, login_form.remember_me.data)
@@ -126,6 +253,15 @@ class CustomUserManager(UserManager):
 
 
 
+class UserCreationForm(FlaskForm):
+    username = TextField(lazy_gettext(u'Username'),[validators.InputRequired(), validators.Length(max=80)])
+    password = PasswordField(lazy_gettext(u'Password'),[validators.InputRequired()])
+    admin = BooleanField(lazy_gettext(u'Administrator'))
+    language = SelectField(lazy_gettext(u'Language'),choices=language_choices)
+    submit = SubmitField(lazy_gettext(u'Save'))
+
+
+
 class UserEditForm(FlaskForm):
     password = PasswordField(lazy_gettext(u'Password'),[validators.InputRequired()])
     admin = BooleanField(lazy_gettext(u'Administrator'))
@@ -142,6 +278,36 @@ class UserSelfEditForm(FlaskForm):
 
 
 
+class RosterImportForm(FlaskForm):
+    file = FileField(lazy_gettext(u'CSV file'),[FileRequired()])
+    roles = TextField(lazy_gettext(u'Roles of every user, separated by ;'))
+    password = TextField(lazy_gettext(u'Password of the users without one, random by default'))
+    submit = SubmitField(lazy_gettext(u'Import'))
+
+
+
+def get_role(name):
+    """
+    Return the role called name, added to the session if it doesn't exist
+    """
+    role = Role.query.filter(Role.name == name).first()
+    if role is None:
+        role = Role(name=name)
+        db.session.add(role)
+    return role
+
+def new_user(form):
+    """
+    Return the user of a UserCreationForm, administrators having the Admin
+    and Agent roles like the default admin user
+    """
+    user = User(username=form.username.data, locale=form.language.data)
+    user.set_password(form.password.data)
+    if form.admin.data:
+        user.roles = [get_role(name) for name in ('Admin', 'Agent')]
+    return user
+
+
 @bp.route('/register', methods=('GET','POST'))
 @roles_required('Admin')
 def register():
@@ -149,17 +315,16 @@ def register():
     form = UserCreationForm()
 
     if form.validate_on_submit():
-        qry = db.session.query(User).filter(
+        qry = db.session.query(User.id).filter(
                     User.username == form.username.data)
         if qry.first() is not None:
             flash(lazy_gettext(u'User {} is already registered.').format(form.username.data),'danger')
+            return render_template('auth/register.html', form=form)
 
-        user = User(form.username.data, form.password.data, form.admin.data)
-        user.locale = form.language.data
-        db.session.add(user)
+        db.session.add(new_user(form))
         db.session.commit()
       
-        return redirect(url_for('index'))
+        return redirect(url_for('.userlist'))
 
     return render_template('auth/register.html', form=form)
 
@@ -168,18 +333,17 @@ def register():
 def auth_init():
     qry = db.session.query(User)
     if qry.first() is not None:
-        flash(lazy_gettext(u'An admin user has already been created'),'danger')
-        return redirect(url_for('index'))
+        flash(gettext(u'An admin user has already been created'),'danger')
+        return redirect(url_for('books.index'))
 
     form = UserCreationForm()
 
     if form.validate_on_submit():
-        user = User(form.username.data, form.password.data, True)
-        user.locale = form.language.data
-        db.session.add(user)
+        form.admin.data = True
+        db.session.add(new_user(form))
         db.session.commit()
       
-        return redirect(url_for('index'))
+        return redirect(url_for('books.index'))
 
     return render_template('auth/register.html', form=form)
 
@@ -195,35 +359,270 @@ class LanguageCol(Col):
 
 class RoleCol(Col):
     def td_format(self,content):
-        roles=[]
-        for role in content:
-            roles+=role.name +', '
-        return roles[:-2]
+        return ', '.join(role.name for role in content)
 
 
-class UserTable(Table):
+class UserTable(SortableTable):
     classes = ['table']
-    id = Col('Id')
+    id = Col('Id', allow_sort=False)
     username = Col(lazy_gettext(u'Username'))
-    roles = RoleCol(lazy_gettext(u'Roles'))
+    roles = RoleCol(lazy_gettext(u'Roles'), allow_sort=False)
     locale = LanguageCol(lazy_gettext(u'Language'))
-    edit = ButtonCol(lazy_gettext(u'Edit'), '.edit', url_kwargs=dict(userid='id'))
+    edit = ButtonCol(lazy_gettext(u'Edit'), '.edit', url_kwargs=dict(userid='id'), allow_sort=False)
+    rentals = LinkCol(lazy_gettext(u'Rentals'), 'rentals.user', url_kwargs=dict(userid='id'), allow_sort=False)
+
+
+class UserFilterForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    name = TextField(lazy_gettext(u'Username'))
+    role = SelectField(lazy_gettext(u'Role'))
+    locale = SelectField(lazy_gettext(u'Language'),
+                         choices=[('', lazy_gettext(u'All'))] + language_choices)
+    submit = SubmitField(lazy_gettext(u'Filter'))
 
 
+user_sort_columns = {
+    'username': User.username,
+    'locale': User.locale,
+}
+
 @bp.route('/userlist')
 @roles_required('Admin')
 def userlist():
-    results = User.query.all()
- 
-    if not results:
-        flash(lazy_gettext(u'No users found!'))
-        return redirect('/')
-    else:
-        # display results
-        table = UserTable(results, no_items='There is nothing')
-        table.__html__()
-        table.border = True
-        return render_template('auth/userlist.html', table=table)
+    form = UserFilterForm(request.args)
+    form.role.choices = [('', lazy_gettext(u'All'))] + \
+        [(name, name) for name, in db.session.query(Role.name).order_by(Role.name)]
+
+    # The roles of the whole page are loaded by a single extra query
+    qry = User.query.options(selectinload(User.roles))
+    if form.name.data:
+        qry = qry.filter(User.username.startswith(form.name.data, autoescape=True))
+    if form.role.data:
+        qry = qry.filter(User.roles.any(Role.name == form.role.data))
+    if form.locale.data:
+        qry = qry.filter(User.locale == form.locale.data)
+    page = paginate(qry, user_sort_columns, 'username', User.username,
+                    current_app.config['USERS_PER_PAGE'])
+
+    table = UserTable(page.items, sort_by=page.sort, sort_reverse=page.reverse,
+                      no_items=lazy_gettext(u'No users found!'))
+    table.border = True
+    return render_template('auth/userlist.html', table=table, form=form, page=page)
+
+def export_query():
+    return db.session.query(User.id, User.username, User.first_name, User.last_name,
+                            User.locale, User.active).order_by(User.username)
+
+@bp.route('/export.<any(csv, ndjson):fmt>')
+@roles_required('Admin')
+def export(fmt):
+    """
+    Download the list of users as CSV or NDJSON
+    """
+    return export_response(export_query(), fmt, 'users')
+
+@bp.cli.command('export')
+@click.option('--format', 'fmt', type=click.Choice(sorted(export_formats)), default='csv')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-',
+              help='File the users are written to, standard output by default.')
+def export_command(fmt, output):
+    """Export the users."""
+    export_file(export_query(), fmt, output)
+
+def create_default_users(password='Password1'):
+    """
+    Create the 'user' user with no roles and the 'admin' user with the Admin
+    and Agent roles, unless they exist. Return the names of the created users.
+    """
+    created = []
+    if not User.query.filter(User.username == 'user').first():
+        user = User(
+            username='user',
+            password=current_app.user_manager.hash_password(password),
+        )
+        db.session.add(user)
+        created.append(user.username)
+
+    if not User.query.filter(User.username == 'admin').first():
+        user = User(
+            username='admin',
+            password=current_app.user_manager.hash_password(password),
+        )
+        for name in ('Admin', 'Agent'):
+            user.roles.append(get_role(name))
+        db.session.add(user)
+        created.append(user.username)
+    db.session.commit()
+    return created
+
+@bp.cli.command('create-default-users')
+@click.option('--password', default='Password1', help='Password of the created users.')
+def create_default_users_command(password):
+    """Create the default user and admin users."""
+    for username in create_default_users(password):
+        click.echo('Created {}'.format(username))
+
+def split_roles(value):
+    return [name.strip() for name in (value or '').split(';') if name.strip()]
+
+def provision_users(fp, on_error, on_user, roles=(), password=None, rounds=None, batch_size=500):
+    """
+    Create the users of a class roster CSV file with a username header and
+    optional first_name, last_name, password, locale and roles (separated
+    by ';') columns. Every user also gets the given roles, the missing roles
+    are created. Users without a password get password, or a random one.
+
+    Rows are read one at a time and inserted in batches of batch_size, the
+    passwords of a batch being hashed in parallel at the cost rounds.
+    Existing usernames are left as they are but for their missing roles, so
+    that provisioning the same roster again changes nothing. Invalid rows
+    are skipped and reported through on_error(line, message), then every
+    user of the roster through on_user(id, username, first_name, last_name,
+    password), password being None unless it was generated. Return the
+    number of users created.
+    """
+    reader = csv.DictReader(fp)
+    if 'username' not in (reader.fieldnames or []):
+        on_error(1, gettext(u'Missing columns: {}').format('username'))
+        return 0
+
+    locales = dict(language_choices)
+    role_ids = {}
+
+    def role_id(name):
+        if name not in role_ids:
+            role = get_role(name)
+            db.session.flush()
+            role_ids[name] = role.id
+        return role_ids[name]
+
+    def insert(batch):
+        existing = dict(db.session.query(User.username, User.id).filter(
+            User.username.in_([user['username'] for line, user, names, password, generated in batch])))
+        new = [entry for entry in batch if entry[1]['username'] not in existing]
+        hashes = current_app.user_manager.password_manager.hash_passwords(
+            [password for line, user, names, password, generated in new], rounds)
+
+        ids = dict(existing)
+        users = []
+        for (line, user, names, password, generated), password_hash in zip(new, hashes):
+            ids[user['username']] = uuid.uuid4()
+            users.append(dict(user, id=ids[user['username']], password=password_hash, active=True))
+
+        granted = set()
+        if existing:
+            granted = set(tuple(user_role) for user_role in db.session.query(
+                UserRoles.user_id, UserRoles.role_id).filter(UserRoles.user_id.in_(list(existing.values()))))
+        user_roles = []
+        for line, user, names, password, generated in batch:
+            for name in names:
+                user_role = (ids[user['username']], role_id(name))
+                if user_role not in granted:
+                    granted.add(user_role)
+                    user_roles.append(dict(user_id=user_role[0], role_id=user_role[1]))
+
+        db.session.bulk_insert_mappings(User, users)
+        db.session.bulk_insert_mappings(UserRoles, user_roles)
+        db.session.commit()
+        # Bulk inserts don't go through the session events evicting the
+        # cached users whose roles changed
+        forget_users(existing.values())
+
+        for line, user, names, password, generated in batch:
+            on_user(ids[user['username']], user['username'], user['first_name'], user['last_name'],
+                    None if user['username'] in existing else generated)
+        return len(users)
+
+    count = 0
+    batch = []
+    usernames = set()
+    for line, row in enumerate(reader, 2):
+        user = dict((column, (row.get(column) or '').strip())
+                    for column in ('username', 'first_name', 'last_name', 'locale'))
+        user['locale'] = user['locale'] or current_app.config['BABEL_DEFAULT_LOCALE']
+        error = None
+        if not user['username']:
+            error = gettext(u'Username is required')
+        elif len(user['username']) > 80:
+            error = gettext(u'Username {} is longer than 80 characters').format(user['username'])
+        elif len(user['first_name']) > 50 or len(user['last_name']) > 50:
+            error = gettext(u'First and last names are limited to 50 characters')
+        elif user['locale'] not in locales:
+            error = gettext(u'Unknown language {}').format(user['locale'])
+        elif user['username'] in usernames:
+            error = gettext(u'Username {} is already in the file').format(user['username'])
+        if error:
+            on_error(line, error)
+            continue
+
+        generated = None
+        user_password = (row.get('password') or '').strip() or password
+        if not user_password:
+            user_password = generated = secrets.token_urlsafe(6)
+        batch.append((line, user, list(roles) + split_roles(row.get('roles')), user_password, generated))
+        usernames.add(user['username'])
+        if len(batch) >= batch_size:
+            count += insert(batch)
+            batch = []
+    if batch:
+        count += insert(batch)
+    return count
+
+@bp.route('/provision', methods=['GET', 'POST'])
+@roles_required('Admin')
+def provision():
+    """
+    Create the users of an uploaded class roster CSV file, listing their
+    badge ids
+    """
+    form = RosterImportForm()
+    errors = []
+    users = []
+    roles = split_roles(form.roles.data)
+
+    if form.validate_on_submit():
+        # Only the first errors are displayed, the file may be garbage
+        def on_error(line, message):
+            if len(errors) < 1000:
+                errors.append((line, message))
+
+        def on_user(userid, username, first_name, last_name, password):
+            users.append((userid.hex, username, first_name, last_name, password))
+
+        fp = codecs.getreader('utf-8-sig')(form.file.data.stream)
+        count = provision_users(fp, on_error, on_user, roles, form.password.data or None,
+                                current_app.config['PASSWORD_INITIAL_ROUNDS'],
+                                current_app.config['USERS_PROVISION_BATCH_SIZE'])
+        flash(lazy_gettext(u'{count} users created').format(count=count), 'success')
+
+    return render_template('auth/provision.html', form=form, errors=errors, users=users, roles=roles)
+
+@bp.cli.command('provision')
+@click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--role', 'roles', multiple=True, help='Role given to every user, may be repeated.')
+@click.option('--password', help='Password of the users without one in the roster, random by default.')
+@click.option('--rounds', type=int, help='bcrypt cost of the passwords, PASSWORD_INITIAL_ROUNDS by default.')
+@click.option('--batch-size', type=int, help='Number of users inserted per transaction.')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-',
+              help='CSV file the badge ids are written to, standard output by default.')
+def provision_command(file, roles, password, rounds, batch_size, output):
+    """Create the users of a class roster CSV file."""
+    writer = csv.writer(output)
+    writer.writerow(('id', 'username', 'first_name', 'last_name', 'password'))
+
+    def on_error(line, message):
+        click.echo(u'Line {}: {}'.format(line, message), err=True)
+
+    def on_user(userid, username, first_name, last_name, password):
+        writer.writerow((userid.hex, username, first_name, last_name, password or ''))
+
+    count = provision_users(file, on_error, on_user, roles, password,
+                            rounds or current_app.config['PASSWORD_INITIAL_ROUNDS'],
+                            batch_size or current_app.config['USERS_PROVISION_BATCH_SIZE'])
+    click.echo('{} users created'.format(count), err=True)
+
 
 @bp.route('/user/<uuid:userid>', methods=['GET', 'POST'])
 @login_required
@@ -238,10 +637,10 @@ def edit(userid):
 
             if form.validate_on_submit():
                 # Save modifications
-                if form.new_password.data is not '' and check_password_hash(user.password, form.old_password.data):
-                    user.password = generate_password_hash(form.new_password.data)
-                elif form.new_password.data is not '':
-                    flash(lazy_gettext(u'Incorrect old password'))
+                if form.new_password.data != '' and user.check_password(form.old_password.data):
+                    user.set_password(form.new_password.data)
+                elif form.new_password.data != '':
+                    flash(gettext(u'Incorrect old password'))
 
                 user.locale = form.language.data
                 print(current_user.locale)# = form.language.data
@@ -258,10 +657,10 @@ def edit(userid):
 
             if form.validate_on_submit():
                 # Save modifications
-                user.password = generate_password_hash(form.password.data)
+                user.set_password(form.password.data)
                 user.admin = form.admin.data
                 db.session.commit()
-                flash(lazy_gettext(u'User updated successfully!'))
+                flash(gettext(u'User updated successfully!'))
                 return redirect(url_for('.userlist'))
 
             return render_template('auth/edit.html', form=form, username=user.username)
@@ -275,31 +674,50 @@ def edit(userid):
         return redirect(url_for('.userlist'))
 
 
+# Number of rendered barcodes kept in memory
+BARCODE_CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=BARCODE_CACHE_SIZE)
+def render_barcode(code):
+    """
+    Render code as a Code128 SVG, returning the SVG element along with a
+    strong ETag of its content. A user's UUID never changes so each badge is
+    rendered once and then served from the cache.
+    """
+    encoded_output = render_svg(code)
+    return encoded_output, hashlib.sha1(encoded_output.encode()).hexdigest()
+
+
 @bp.route('/user/<uuid:userid>/barcode', methods=['GET', 'POST'])
 @login_required
 def barcode(userid):
-    import barcode
-    from barcode import writer
-    from io import BytesIO, StringIO
+    if userid == current_user.id:
+        # The SVG itself is served, and cached by the browser, by barcode_svg
+        return render_template('auth/barcode.html', userid=userid, username=current_user.username)
 
     qry = db.session.query(User).filter(User.id==userid)
     user = qry.first()
 
     if user:
-        if userid == current_user.id:
-            fp = BytesIO()
-            print(userid)
-            code128 = barcode.get_barcode_class('code128')
-            the_code = code128(userid.hex)
-            the_code.write(fp)
-            encoded_output = fp.getvalue().decode()
-            encoded_output = encoded_output[encoded_output.find('<svg'):]
-            fp.close()
-            return render_template('auth/barcode.html', encoded_output=encoded_output, username=current_user.username)
-
-        else:
-            flash(lazy_gettext(u"You don't have the rights to display: \"{user}\"'s barcode").format(user=userid.hex))
-            redirect(url_for('index'))
+        flash(lazy_gettext(u"You don't have the rights to display: \"{user}\"'s barcode").format(user=userid.hex))
+        return redirect(url_for('books.index'))
     else:
         flash(lazy_gettext(u'ERROR: User \"{userid}\" doesn''t exist').format(userid=userid.hex))
-        return redirect(url_for('index'))
+        return redirect(url_for('books.index'))
+
+
+@bp.route('/user/<uuid:userid>/barcode.svg')
+@login_required
+def barcode_svg(userid):
+    """
+    Serve the raw SVG of the user's barcode, cacheable by the browser
+    """
+    if userid != current_user.id:
+        abort(403)
+
+    encoded_output, etag = render_barcode(userid.hex)
+    response = Response(encoded_output, mimetype='image/svg+xml')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = 365 * 24 * 3600
+    return response.make_conditional(request)
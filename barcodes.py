@@ -0,0 +1,111 @@
+# Barcode rendering, kept free of any Flask or database import so that it
+# can run in worker processes
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import hashlib
+import os
+
+# Bump when the rendering below changes, to invalidate cached labels
+RENDER_VERSION = 1
+
+# Label options, sized so that a 32 characters UUID fits a label
+label_options = dict(module_width=0.2, module_height=10, font_size=8,
+                     text_distance=3, quiet_zone=2)
+
+# A4 sheets of 2 x 8 labels
+PAGE_WIDTH, PAGE_HEIGHT = 210, 297
+PAGE_MARGIN = 10
+LABEL_COLUMNS, LABEL_ROWS = 2, 8
+
+
+# python-barcode is only imported by the first rendering
+_code128 = None
+
+def code128():
+    global _code128
+    if _code128 is None:
+        import barcode
+        _code128 = barcode.get_barcode_class('code128')
+    return _code128
+
+
+def render_svg(code, options=None, text=None):
+    """
+    Render code as a Code128 SVG element
+    """
+    fp = BytesIO()
+    code128()(code).write(fp, options, text)
+    encoded_output = fp.getvalue().decode()
+    fp.close()
+    return encoded_output[encoded_output.find('<svg'):]
+
+
+def render_label(label):
+    """
+    Render a (code, caption) label
+    """
+    code, caption = label
+    return render_svg(code, label_options, caption)
+
+
+def label_key(label):
+    """
+    Content hash of a label, naming its file in the disk cache
+    """
+    content = u'{}\0{}\0{}'.format(RENDER_VERSION, *label)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def render_labels(labels, cache_dir, processes=None):
+    """
+    Render a list of (code, caption) labels, reading the already rendered
+    ones from cache_dir and rendering the others across a process pool
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    paths = [os.path.join(cache_dir, label_key(label) + '.svg') for label in labels]
+    svgs = [None] * len(labels)
+    missing = []
+    for i, path in enumerate(paths):
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as fp:
+                svgs[i] = fp.read()
+        else:
+            missing.append(i)
+
+    # Starting the pool only pays off for more than a few labels
+    if len(missing) > 32 and processes != 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            rendered = list(executor.map(render_label, [labels[i] for i in missing],
+                                         chunksize=64))
+    else:
+        rendered = [render_label(labels[i]) for i in missing]
+
+    for i, svg in zip(missing, rendered):
+        svgs[i] = svg
+        # Write then rename so that concurrent renderings never read half a file
+        tmp_path = '{}.{}.tmp'.format(paths[i], os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            fp.write(svg)
+        os.replace(tmp_path, paths[i])
+    return svgs
+
+
+def label_pages(svgs):
+    """
+    Lay rendered labels out on A4 pages, returning one SVG document per page
+    """
+    per_page = LABEL_COLUMNS * LABEL_ROWS
+    width = (PAGE_WIDTH - 2 * PAGE_MARGIN) / float(LABEL_COLUMNS)
+    height = (PAGE_HEIGHT - 2 * PAGE_MARGIN) / float(LABEL_ROWS)
+    pages = []
+    for start in range(0, len(svgs), per_page):
+        cells = []
+        for i, svg in enumerate(svgs[start:start + per_page]):
+            x = PAGE_MARGIN + (i % LABEL_COLUMNS) * width
+            y = PAGE_MARGIN + (i // LABEL_COLUMNS) * height
+            cells.append(svg.replace('<svg', '<svg x="{:.1f}mm" y="{:.1f}mm"'.format(x, y), 1))
+        pages.append(
+            '<svg version="1.1" xmlns="http://www.w3.org/2000/svg" '
+            'width="{}mm" height="{}mm">\n{}\n</svg>\n'.format(
+                PAGE_WIDTH, PAGE_HEIGHT, '\n'.join(cells)))
+    return pages
@@ -0,0 +1,15 @@
+# Benchmarks, run from the repository root with python -m benchmarks.<name>.
+# They use a throwaway SQLite database unless DATABASE_URL is set.
+import os
+import tempfile
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(
+    tempfile.mkdtemp(prefix='schooldb-bench-'), 'bench.db'))
+
+from app import create_app, init_db
+from auth import create_default_users
+
+app = create_app()
+with app.app_context():
+    init_db()
+    create_default_users()
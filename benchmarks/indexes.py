@@ -0,0 +1,75 @@
+# Query plans and latency of the hot lookups of the titles, books and roles, without
+# and with their indexes, on a seeded catalog:
+# python -m benchmarks.indexes [number of books]
+from app import db
+from benchmarks import app
+from auth import Role, UserRoles
+from benchmarks.seed import isbn13, seed
+from books import Book, Title
+from sqlalchemy import bindparam, text
+import sys
+import timeit
+
+
+def queries(users):
+    """
+    Return the (name, query) of the lookups made by the application
+    """
+    userid, username = users[42]
+    return [
+        ('isbn13 lookup (checkout)',
+         Title.query.filter(Title.isbn13 == isbn13(12345))),
+        ('books of a renter',
+         Book.query.filter(Book.renter_name == username)),
+        ('category page',
+         Title.query.filter(Title.category > 'game').order_by(Title.category, Title.id).limit(50)),
+        ('copies of a title',
+         Book.query.filter(Book.title_id == 12345)),
+        ('latest rentals',
+         Book.query.filter(Book.rented_time.isnot(None))
+         .order_by(Book.rented_time.desc()).limit(50)),
+        ('roles of a user',
+         Role.query.join(UserRoles, UserRoles.role_id == Role.id)
+         .filter(UserRoles.user_id == userid)),
+    ]
+
+
+def explain(qry):
+    # Named parameters, bound with their types since a UUID has no literal
+    compiled = qry.statement.compile()
+    params = [bindparam(key, value, type_=compiled.binds[key].type)
+              for key, value in compiled.params.items()]
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    statement = text(prefix + str(compiled)).bindparams(*params)
+    return [' '.join(str(value) for value in row) for row in db.session.execute(statement)]
+
+
+def measure(label, users, number=200):
+    print('== {} indexes'.format(label))
+    for name, qry in queries(users):
+        seconds = timeit.timeit(lambda: qry.all(), number=number) / number
+        print('{:28} {:10.1f} us'.format(name, seconds * 1e6))
+        for line in explain(qry):
+            print('    ' + line)
+    print()
+
+
+def main(count=100000):
+    users = seed(100, count)
+    with app.app_context():
+        db.session.execute('ANALYZE')
+        indexes = [index for table in (Title.__table__, Book.__table__, UserRoles.__table__)
+                   for index in table.indexes]
+
+        for index in indexes:
+            index.drop(db.engine)
+        measure('without', users)
+
+        for index in indexes:
+            index.create(db.engine)
+        db.session.execute('ANALYZE')
+        measure('with', users)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
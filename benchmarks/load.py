@@ -0,0 +1,151 @@
+# Load test of the main pages through the Flask test client, reporting the
+# throughput and latency percentiles of each page as JSON:
+# python -m benchmarks.load --users 100 --books 10000 --concurrency 8 --output load.json
+# Seeds the benchmark database first unless --no-seed is given.
+from benchmarks import app
+from benchmarks.seed import PASSWORD, nouns, seed
+from auth import User
+from books import Book
+from threading import Thread
+import argparse
+import datetime
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+
+
+def percentile(latencies, p):
+    """
+    Return the p-th percentile of sorted latencies, by nearest rank
+    """
+    if not latencies:
+        return None
+    rank = max(int(round(p / 100.0 * len(latencies))) - 1, 0)
+    return latencies[min(rank, len(latencies) - 1)]
+
+
+class VirtualUser(Thread):
+    """
+    Logs in then requests pages at random, recording the latency and status
+    of every request by page
+    """
+
+    def __init__(self, user, requests, book_ids, random_seed):
+        Thread.__init__(self)
+        self.userid, self.username = user
+        self.requests = requests
+        self.book_ids = book_ids
+        self.rng = random.Random(random_seed)
+        self.results = []
+
+    def timed(self, name, request):
+        start = time.perf_counter()
+        response = request()
+        response.close()
+        self.results.append((name, time.perf_counter() - start, response.status_code))
+
+    def run(self):
+        client = app.test_client()
+        self.timed('login', lambda: client.post(
+            '/user/sign-in', data=dict(username=self.username, password=PASSWORD)))
+        pages = [
+            ('books.index', lambda: client.get('/books/')),
+            ('books.search_results', lambda: client.get(
+                '/books/results/{}'.format(self.rng.choice(nouns)))),
+            ('books.rent', lambda: client.get(
+                '/books/rent_item/{}'.format(self.rng.choice(self.book_ids)))),
+            ('auth.barcode', lambda: client.get('/auth/user/{}/barcode'.format(self.userid))),
+        ]
+        for i in range(self.requests):
+            self.timed(*self.rng.choice(pages))
+
+
+def version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results, elapsed):
+    """
+    Return the count, errors, throughput and percentiles of results by page
+    and overall
+    """
+    pages = {}
+    for name, latency, status in results:
+        pages.setdefault(name, []).append((latency, status))
+    pages['all'] = [(latency, status) for name, latency, status in results]
+
+    summary = {}
+    for name, requests in sorted(pages.items()):
+        latencies = sorted(latency for latency, status in requests)
+        summary[name] = dict(
+            requests=len(requests),
+            errors=sum(1 for latency, status in requests if status >= 400),
+            throughput=len(requests) / elapsed,
+            mean_ms=1000 * sum(latencies) / len(latencies),
+            p50_ms=1000 * percentile(latencies, 50),
+            p95_ms=1000 * percentile(latencies, 95),
+            p99_ms=1000 * percentile(latencies, 99),
+        )
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test of the main pages')
+    parser.add_argument('--users', type=int, default=100, help='users to seed')
+    parser.add_argument('--books', type=int, default=10000, help='books to seed')
+    parser.add_argument('--concurrency', type=int, default=8, help='simultaneous users')
+    parser.add_argument('--requests', type=int, default=200, help='requests per user')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--no-seed', action='store_true', help='use the existing data')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    args = parser.parse_args(argv)
+
+    # The virtual users post the login form without its CSRF token
+    app.config['WTF_CSRF_ENABLED'] = False
+    if not args.no_seed:
+        seed(args.users, args.books, args.seed)
+    with app.app_context():
+        users = User.query.with_entities(User.id, User.username) \
+            .filter(User.username.like('bench%')).limit(args.concurrency).all()
+        book_ids = [id for id, in Book.query.with_entities(Book.id)]
+    if not users or not book_ids:
+        sys.exit('No benchmark users or books, seed the database first')
+
+    threads = [VirtualUser(users[i % len(users)], args.requests, book_ids, args.seed + i)
+               for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    results = dict(
+        date=datetime.datetime.utcnow().isoformat(),
+        version=version(),
+        python=platform.python_version(),
+        database=app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+        parameters=dict(vars(args)),
+        elapsed=elapsed,
+        pages=report([result for thread in threads for result in thread.results], elapsed),
+    )
+
+    print('{:24} {:>8} {:>6} {:>8} {:>8} {:>8} {:>8}'.format(
+        'page', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, page in results['pages'].items():
+        print('{:24} {requests:8d} {errors:6d} {throughput:8.1f} {p50_ms:8.1f} '
+              '{p95_ms:8.1f} {p99_ms:8.1f}'.format(name, **page))
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# Latency of a burst of simultaneous logins, as when a whole class logs in at
+# once: python -m benchmarks.logins [number of logins]
+from benchmarks import app
+from benchmarks.load import percentile
+from benchmarks.seed import PASSWORD, seed
+from threading import Barrier, Thread
+import sys
+import time
+
+
+def main(logins=200):
+    app.config['WTF_CSRF_ENABLED'] = False
+    users = seed(logins, 0)
+    barrier = Barrier(logins)
+    results = []
+
+    def login(username):
+        client = app.test_client()
+        barrier.wait()
+        start = time.perf_counter()
+        response = client.post('/user/sign-in', data=dict(username=username, password=PASSWORD))
+        results.append((time.perf_counter() - start, response.status_code))
+
+    threads = [Thread(target=login, args=(username,)) for userid, username in users]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, status in results)
+    statuses = {}
+    for latency, status in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    print('{} logins in {:.2f}s, statuses {}'.format(logins, elapsed, statuses))
+    for p in (50, 95, 99):
+        print('p{}: {:8.1f} ms'.format(p, 1000 * percentile(latencies, p)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,26 @@
+# Per request cost of rendering the navbar, built from scratch versus served
+# from the navbar cache: python -m benchmarks.navbar
+from benchmarks import app
+from auth import User
+from flask_login import login_user
+from navbar import mynavbar, navbar_processor
+import timeit
+
+
+def main(number=2000):
+    with app.test_request_context('/books/'):
+        user = User.query.filter(User.username == 'admin').first()
+        login_user(user)
+        render_navbar = navbar_processor()['render_navbar']
+        render_navbar()
+
+        built = timeit.timeit(lambda: mynavbar().render(), number=number) / number
+        cached = timeit.timeit(render_navbar, number=number) / number
+
+    print('built:  {:8.1f} us per request'.format(built * 1e6))
+    print('cached: {:8.1f} us per request'.format(cached * 1e6))
+    print('saving: {:8.1f} us per request ({:.0f}x)'.format((built - cached) * 1e6, built / cached))
+
+
+if __name__ == '__main__':
+    main()
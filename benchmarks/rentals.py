@@ -0,0 +1,101 @@
+# Latency of the rental reports over several school years of history:
+# python -m benchmarks.rentals [number of rentals] [number of years]
+from app import db
+from benchmarks import app
+from benchmarks.indexes import explain
+from benchmarks.seed import PASSWORD, seed
+from books import Book, Rental, Title
+from sqlalchemy import func
+import datetime
+import random
+import statistics
+import sys
+import time
+
+
+def seed_history(count, years, users, rng, batch_size=10000):
+    """
+    Add count returned rentals made over the last years, then the rentals of
+    the books currently rented
+    """
+    books = db.session.query(Book.id, Title.category).join(Title, Title.id == Book.title_id).all()
+    user_ids = [userid for userid, username in users]
+    now = datetime.datetime.now()
+    rentals = []
+    for i in range(count):
+        book_id, category = rng.choice(books)
+        checkout_time = now - datetime.timedelta(minutes=rng.randrange(years * 365 * 24 * 60))
+        rentals.append(dict(book_id=book_id, user_id=rng.choice(user_ids), category=category,
+                            checkout_time=checkout_time,
+                            return_time=checkout_time + datetime.timedelta(days=rng.randrange(1, 40))))
+        if len(rentals) == batch_size:
+            db.session.bulk_insert_mappings(Rental, rentals)
+            rentals = []
+    db.session.bulk_insert_mappings(Rental, rentals)
+
+    ids = dict((username, userid) for userid, username in users)
+    db.session.bulk_insert_mappings(Rental, [
+        dict(book_id=book.id, user_id=ids[book.renter_name], category=book.category,
+             checkout_time=book.rented_time)
+        for book in db.session.query(Book.id, Book.renter_name, Book.rented_time, Title.category)
+        .join(Title, Title.id == Book.title_id).filter(Book.renter_name.isnot(None))])
+    db.session.commit()
+
+
+def reports(users):
+    """
+    Return the (name, URL, query) of the reports, the query being the one
+    the report is slow on
+    """
+    userid, username = users[42]
+    today = datetime.date.today()
+    year_ago = today - datetime.timedelta(days=365)
+    overdue = datetime.datetime.now() - datetime.timedelta(days=app.config['RENTAL_LOAN_DAYS'])
+    usage = db.session.query(Rental.category, func.count()).group_by(Rental.category)
+    return [
+        ('books out', '/rentals/',
+         Rental.query.filter(Rental.return_time.is_(None))
+         .order_by(Rental.checkout_time, Rental.id).limit(51)),
+        ('overdue since today', '/rentals/?overdue_since={}'.format(today),
+         Rental.query.filter(Rental.return_time.is_(None), Rental.checkout_time < overdue)
+         .order_by(Rental.checkout_time, Rental.id).limit(51)),
+        ('history of a user', '/rentals/user/{}'.format(userid),
+         Rental.query.filter(Rental.user_id == userid)
+         .order_by(Rental.checkout_time, Rental.id).limit(51)),
+        ('usage, all time', '/rentals/usage', usage),
+        ('usage, last year', '/rentals/usage?start={}'.format(year_ago),
+         usage.filter(Rental.checkout_time >= year_ago)),
+    ]
+
+
+def main(count=500000, years=5, runs=10):
+    users = seed(1500, 20000)
+    with app.app_context():
+        seed_history(count, years, users, random.Random(0))
+        db.session.execute('ANALYZE')
+        print('{} rentals over {} years'.format(Rental.query.count(), years))
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    client.post('/user/sign-in', data=dict(username='admin', password=PASSWORD))
+    with app.test_request_context():
+        for name, url, qry in reports(users):
+            timings = []
+            for i in range(runs):
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - start)
+                assert response.status_code == 200, (url, response.status_code)
+            print('{:22} median {:7.1f} ms  max {:7.1f} ms'.format(
+                name, 1000 * statistics.median(timings), 1000 * max(timings)))
+            for line in explain(qry):
+                print('    ' + line)
+
+        start = time.perf_counter()
+        size = len(client.get('/rentals/export.csv').get_data())
+        print('{:22} {:7.1f} s for {:.1f} MB'.format('export, all time', time.perf_counter() - start,
+                                                     size / 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
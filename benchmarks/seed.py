@@ -0,0 +1,156 @@
+# Synthetic users and books for the benchmarks:
+# python -m benchmarks.seed [number of users] [number of books]
+# Seeds the database of DATABASE_URL, a throwaway one by default.
+from app import db
+from benchmarks import app
+from auth import Role, User, UserRoles
+from books import Book, Title, book_categories, bump_catalog_version, load_search_indexes
+from sqlalchemy import func
+import datetime
+import itertools
+import random
+import sys
+
+# Password of every seeded user
+PASSWORD = 'Password1'
+
+# One in RENTED_RATIO books is rented
+RENTED_RATIO = 5
+
+# One in CLASS_SET_RATIO titles has CLASS_SET_COPIES copies, the others one
+CLASS_SET_RATIO = 20
+CLASS_SET_COPIES = 30
+
+adjectives = ['Little', 'Silent', 'Hidden', 'Last', 'Golden', 'Broken', 'Wild',
+              'Forgotten', 'Secret', 'Strange', 'Early', 'Distant', 'Bright']
+nouns = ['Prince', 'River', 'Garden', 'City', 'Grammar', 'Island', 'Letters',
+         'Mountain', 'Orchard', 'Kingdom', 'Voyage', 'Lessons', 'Winter', 'Stories']
+first_names = ['Marie', 'Jean', 'Alice', 'Victor', 'Emile', 'Claire', 'Paul',
+               'Simone', 'Albert', 'George', 'Colette', 'Jules', 'Anne']
+last_names = ['Hugo', 'Verne', 'Sand', 'Camus', 'Zola', 'Dumas', 'Proust',
+              'Colette', 'Balzac', 'Duras', 'Flaubert', 'Stendhal', 'Ernaux']
+publishers = ['Gallimard', 'Hachette', 'Nathan', 'Belin', 'Hatier', 'Flammarion',
+              'Larousse', 'Bordas', 'Magnard', 'Didier']
+
+
+def isbn13(i):
+    """
+    Return the i-th ISBN 13, with a valid checksum
+    """
+    digits = '978{:09d}'.format(i)
+    checksum = sum(int(digit) * (3 if n % 2 else 1) for n, digit in enumerate(digits))
+    return digits + str((10 - checksum % 10) % 10)
+
+
+def seed_users(count, rng):
+    """
+    Add count users, one in ten of them an Admin and one in three an Agent,
+    all with the PASSWORD password. Return their (id, username).
+    """
+    roles = {}
+    for name in ('Admin', 'Agent'):
+        roles[name] = Role.query.filter(Role.name == name).first() or Role(name=name)
+        db.session.add(roles[name])
+    db.session.flush()
+
+    # Hashing is slow on purpose, every user shares the same hash
+    password = app.user_manager.hash_password(PASSWORD)
+    offset = User.query.count()
+    users = [dict(username='bench{}'.format(offset + i), password=password, active=True,
+                  locale=rng.choice(['en', 'fr']))
+             for i in range(count)]
+    for user in users:
+        db.session.add(User(**user))
+    db.session.flush()
+
+    ids = dict(db.session.query(User.username, User.id)
+               .filter(User.username.in_([user['username'] for user in users])))
+    user_roles = []
+    for i, user in enumerate(users):
+        if i % 10 == 0:
+            user_roles.append(dict(user_id=ids[user['username']], role_id=roles['Admin'].id))
+        if i % 3 == 0:
+            user_roles.append(dict(user_id=ids[user['username']], role_id=roles['Agent'].id))
+    db.session.bulk_insert_mappings(UserRoles, user_roles)
+    db.session.commit()
+    return [(ids[user['username']], user['username']) for user in users]
+
+
+def seed_books(count, usernames, rng, batch_size=10000):
+    """
+    Add titles having count copies in all, one title in CLASS_SET_RATIO being
+    a class set of CLASS_SET_COPIES copies, and one copy in RENTED_RATIO
+    rented by one of usernames during the last month
+    """
+    now = datetime.datetime.now()
+    # Taken first, the row lock of the catalog version keeps the other
+    # writers of titles out, see books.import_books
+    bump_catalog_version(titles=True)
+    offset = db.session.query(func.max(Title.id)).scalar() or 0
+    copies = Book.query.count()
+    titles = []
+    renters = []
+
+    def insert(titles, renters):
+        last_id = db.session.query(func.max(Title.id)).scalar() or 0
+        db.session.bulk_insert_mappings(Title, titles)
+        title_ids = [id for id, in db.session.query(Title.id)
+                                             .filter(Title.id > last_id).order_by(Title.id)]
+        db.session.bulk_insert_mappings(Book, [
+            dict(title_id=title_id, renter_name=renter,
+                 rented_time=now - datetime.timedelta(minutes=rng.randrange(30 * 24 * 60))
+                             if renter else None)
+            for title_id, title_renters in zip(title_ids, renters)
+            for renter in title_renters])
+
+    for i in itertools.count(offset + 1):
+        if count <= 0:
+            break
+        number = min(CLASS_SET_COPIES if i % CLASS_SET_RATIO == 0 else 1, count)
+        count -= number
+        title_renters = []
+        for n in range(number):
+            copies += 1
+            title_renters.append(rng.choice(usernames)
+                                 if usernames and copies % RENTED_RATIO == 0 else None)
+        rented = len([renter for renter in title_renters if renter])
+        renters.append(title_renters)
+        titles.append(dict(
+            title='The {} {}'.format(rng.choice(adjectives), rng.choice(nouns)),
+            publisher=rng.choice(publishers),
+            author='{} {}'.format(rng.choice(first_names), rng.choice(last_names))
+                   if rng.random() > 0.1 else None,
+            isbn13=isbn13(i),
+            category=rng.choice(book_categories)[0],
+            total_copies=number,
+            available_copies=number - rented))
+        if len(titles) >= batch_size:
+            insert(titles, renters)
+            titles = []
+            renters = []
+    insert(titles, renters)
+    db.session.commit()
+
+
+def seed(users=100, books=10000, random_seed=0):
+    """
+    Add users and books to the database, return the (id, username) of the
+    users
+    """
+    rng = random.Random(random_seed)
+    with app.app_context():
+        seeded = seed_users(users, rng)
+        seed_books(books, [username for id, username in seeded], rng)
+        # Built now rather than during the first timed search
+        load_search_indexes()
+    return seeded
+
+
+def main(users=100, books=10000):
+    seed(users, books)
+    print('{} users and {} books added to {}'.format(
+        users, books, app.config['SQLALCHEMY_DATABASE_URI']))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
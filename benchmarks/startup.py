@@ -0,0 +1,43 @@
+# Boot time of a worker: importing the application, creating it and serving
+# its first request, each measured in fresh processes:
+# python -m benchmarks.startup [number of runs]
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+boot = '''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+application.test_client().get('/user/sign-in')
+served = time.perf_counter()
+print(json.dumps(dict(import_app=imported - start, create_app=created - imported,
+                      first_request=served - created)))
+'''
+
+
+def main(runs=10):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings = []
+    for i in range(runs):
+        start = time.perf_counter()
+        output = subprocess.check_output([sys.executable, '-c', boot], cwd=root,
+                                         stderr=subprocess.DEVNULL)
+        timing = json.loads(output.decode().splitlines()[-1])
+        timing['process'] = time.perf_counter() - start
+        timings.append(timing)
+
+    for name in ('import_app', 'create_app', 'first_request', 'process'):
+        values = [timing[name] for timing in timings]
+        print('{:14} median {:7.1f} ms  max {:7.1f} ms'.format(
+            name, 1000 * statistics.median(values), 1000 * max(values)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
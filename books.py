@@ -1,17 +1,36 @@
 from app import db
 from flask_wtf import FlaskForm
-from wtforms import Form, TextField, SelectField, SubmitField, validators, ValidationError
+from flask_wtf.file import FileField, FileRequired
+from wtforms import Form, BooleanField, IntegerField, TextField, SelectField, SubmitField, validators, ValidationError
 from flask import (
-        Blueprint, flash, g, redirect, render_template, request, url_for
+        Blueprint, Response, current_app, flash, g, jsonify, make_response, redirect,
+        render_template, request, session, url_for
         )
 from werkzeug.exceptions import abort
+from markupsafe import Markup
 from auth import login_required, User
 from flask_table import Table, Col, LinkCol, ButtonCol, DatetimeCol
-from flask_babelex import gettext, ngettext, _
+from flask_babelex import gettext, ngettext, _, get_locale
 from flask_babelex import lazy_gettext as _l
 from flask_user import current_user, login_required, roles_required
-from sqlalchemy import or_
+from sqlalchemy import and_, case, func, literal, null, or_, select
+from sqlalchemy_utils import UUIDType
+from collections import namedtuple
+from threading import RLock
+import click
+import codecs
+import csv
+import datetime
 import enum
+import functools
+import hashlib
+import uuid
+from search import fts_match, fuzzy_index, search_words, suggestions
+from pagination import (
+        SortableTable, all_url, paginate, sorted_items, stream_table, stream_template
+        )
+from cache import LRUCache
+from exports import export_file, export_formats, export_response
 
 bp = Blueprint('books', __name__, url_prefix='/books')
 
@@ -24,34 +43,181 @@ book_categories=[('textbook', _l(u'Textbook')),
                 ('game', _l(u'Game'))
                ]
 
-class Book(db.Model):
-    __tablename__ = "books"
+class Title(db.Model):
+    """
+    A book of the catalog, whose physical copies are the Book rows. The
+    number of copies and of available copies are kept up to date by the
+    statements adding, renting and giving back copies, so that availability
+    is read without counting the copies.
+    """
+    __tablename__ = "titles"
 
     id = db.Column(db.Integer, primary_key = True)
     title = db.Column(db.String, nullable = False )
     publisher = db.Column(db.String, nullable = False)
     author = db.Column(db.String, nullable = True)
-    isbn13 = db.Column(db.String(13), nullable = False)
+    # Not unique, books saved before ISBN 13 were checked share empty ones
+    isbn13 = db.Column(db.String(13), nullable = False, index = True)
+    category = db.Column(db.String, nullable = False, index = True)
+    total_copies = db.Column(db.Integer, nullable = False, default = 0)
+    available_copies = db.Column(db.Integer, nullable = False, default = 0)
+
+
+class Book(db.Model):
+    """
+    A physical copy of a title, whose id is printed on its spine label
+    """
+    __tablename__ = "books"
+
+    id = db.Column(db.Integer, primary_key = True)
+    title_id = db.Column(db.Integer, db.ForeignKey("titles.id"), nullable = False, index = True)
+    title_record = db.relationship("Title", backref=db.backref("copies", order_by = id), lazy = True)
     # renter information's:
-    renter_name = db.Column(db.String, db.ForeignKey("users.username"), nullable =True)
-    rented_time = db.Column(db.DateTime, nullable = True)
+    renter_name = db.Column(db.String, db.ForeignKey("users.username"), nullable =True, index = True)
+    rented_time = db.Column(db.DateTime, nullable = True, index = True)
     renter = db.relationship("User", backref=db.backref("books", order_by = id), lazy = True)
+
+
+# Only the rentals still out are in these partial indexes
+open_rental = db.text('return_time IS NULL')
+
+class Rental(db.Model):
+    """
+    History of the rentals, a row being added when a book is rented and
+    closed when it is given back. The category of the book is copied so that
+    usage reports read this table alone.
+    """
+    __tablename__ = "rentals"
+    __table_args__ = (
+        # A book is out at most once, found here when it is given back
+        db.Index('ix_rentals_open_book_id', 'book_id', unique = True,
+                 sqlite_where = open_rental, postgresql_where = open_rental),
+        # Books out and overdue, oldest first
+        db.Index('ix_rentals_open_checkout_time', 'checkout_time',
+                 sqlite_where = open_rental, postgresql_where = open_rental),
+        db.Index('ix_rentals_user_id_checkout_time', 'user_id', 'checkout_time'),
+        db.Index('ix_rentals_category_checkout_time', 'category', 'checkout_time'),
+    )
+
+    id = db.Column(db.Integer, primary_key = True)
+    book_id = db.Column(db.Integer, db.ForeignKey("books.id"), nullable = False)
+    user_id = db.Column(UUIDType, db.ForeignKey("users.id"), nullable = False)
     category = db.Column(db.String, nullable = False)
+    checkout_time = db.Column(db.DateTime, nullable = False)
+    return_time = db.Column(db.DateTime, nullable = True)
+    book = db.relationship("Book", lazy = True)
+    user = db.relationship("User", lazy = True)
 
 
+def count_available(book_id, delta):
+    """
+    Add delta to the available copies of the title of the book #id, relative
+    to the current value so that concurrent rentals of a title add up
+    """
+    Title.query.filter(Title.id == select([Book.title_id]).where(Book.id == book_id).as_scalar()) \
+        .update({Title.available_copies: Title.available_copies + delta},
+                synchronize_session=False)
+
+def record_checkout(book_id, user_id, now):
+    """
+    Record that the book #book_id has just been rented by user_id at now: one
+    copy less of its title is available, and the rental starts in the history
+    """
+    rented = select([Book.id, literal(user_id, UUIDType()), Title.category,
+                     literal(now, db.DateTime())]) \
+        .where(and_(Book.id == book_id, Title.id == Book.title_id))
+    db.session.execute(Rental.__table__.insert().from_select(
+        ['book_id', 'user_id', 'category', 'checkout_time'], rented))
+    count_available(book_id, -1)
+
+def record_return(book_id, now):
+    """
+    Record that the book #book_id has just been given back at now
+    """
+    Rental.query.filter(Rental.book_id == book_id, Rental.return_time.is_(None)) \
+        .update({Rental.return_time: now}, synchronize_session=False)
+    count_available(book_id, 1)
+
+
+class CatalogVersion(db.Model):
+    """
+    Single row counter bumped by every change of the books, keying the
+    caches of rendered book tables. titles_version is only bumped by the
+    changes of the titles, keying the in-memory search indexes.
+    """
+    __tablename__ = "catalog_version"
+
+    id = db.Column(db.Integer, primary_key = True)
+    version = db.Column(db.Integer, nullable = False, default = 0)
+    modified = db.Column(db.DateTime, nullable = True)
+    titles_version = db.Column(db.Integer, nullable = False, default = 0)
+
+
+def init_catalog_version():
+    if not db.session.query(CatalogVersion.query.exists()).scalar():
+        db.session.add(CatalogVersion(id=1, version=0, modified=datetime.datetime.utcnow()))
+        db.session.commit()
+
+def catalog_state():
+    """
+    Return the (version, modified, titles_version) state of the catalog, read
+    once per request
+    """
+    if 'catalog_state' not in g:
+        g.catalog_state = db.session.query(CatalogVersion.version, CatalogVersion.modified,
+                                           CatalogVersion.titles_version) \
+            .filter(CatalogVersion.id == 1).first()
+    return g.catalog_state
+
+def catalog_version():
+    return catalog_state()[0]
+
+def titles_version():
+    return catalog_state()[2]
+
+def bump_catalog_version(titles=False):
+    """
+    Increment the catalog version, and the titles version if titles changed,
+    within the transaction changing the books so that no process can see
+    the change without the new version
+    """
+    values = {CatalogVersion.version: CatalogVersion.version + 1,
+              CatalogVersion.modified: datetime.datetime.utcnow()}
+    if titles:
+        values[CatalogVersion.titles_version] = CatalogVersion.titles_version + 1
+    CatalogVersion.query.filter(CatalogVersion.id == 1) \
+        .update(values, synchronize_session=False)
+    g.pop('catalog_state', None)
+
 
 
 class BookSearchForm(FlaskForm):
     search = TextField('')
+    fuzzy = BooleanField(_l(u'Typo tolerant'))
     submit = SubmitField(_l(u'Search'))
 
 
+def isbn13_error(isbn13, checksum=False):
+    """
+    Return why isbn13 is not a valid ISBN 13, or None if it is
+    """
+    if len(isbn13) != 13:
+        return _l(u'ISBN 13 must be 10 character long')
+    if not isbn13.isdigit():
+        return _l(u'ISBN 13 must contain only numeric characters')
+    if checksum and sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(isbn13)) % 10:
+        return _l(u'ISBN 13 checksum is invalid')
+    return None
+
 def validate_isbn13(form, field):
     if field.data:
-        if len(field.data) != 13:
-            raise ValidationError(_l(u'ISBN 13 must be 10 character long'))
-        if not field.data.isdigit():
-            raise ValidationError(_l(u'ISBN 13 must contain only numeric characters'))
+        error = isbn13_error(field.data)
+        if error:
+            raise ValidationError(error)
+
+class BookImportForm(FlaskForm):
+    file = FileField(_l(u'CSV file'), [FileRequired()])
+    submit = SubmitField(_l(u'Import'))
 
 class BookForm(FlaskForm):
     title = TextField(_l('Title'),[validators.InputRequired()])
@@ -59,6 +225,7 @@ class BookForm(FlaskForm):
     author = TextField(_l('Author'))
     isbn13 = TextField('ISBN 13',[validate_isbn13])
     category = SelectField(_l('Category'), choices=book_categories)
+    new_copies = IntegerField(_l('Copies to add'), [validators.NumberRange(min=0, max=1000)], default=1)
     submit = SubmitField(_l('Save'))
 
 
@@ -73,45 +240,106 @@ def new_book():
 
     if form.validate_on_submit():
         # save the album
-        book = Book()
-        save_changes(book, form, new=True)
-        flash(_l(u'Book created successfully!'),'success')
+        title = Title()
+        save_changes(title, form, new=True)
+        flash(gettext(u'Book created successfully!'),'success')
         return redirect('/')
 
     return render_template('books/new.html', form=form)
 
 
 
-def save_changes( book, form, new = False):
+def add_copies(title_id, count):
     """
-    Save the changes to a given book
+    Add count available copies to the title #title_id
     """
-    import datetime
-
-    book.title = form.title.data
-    book.publisher = form.publisher.data
-    book.author = form.author.data
-    book.isbn13 = form.isbn13.data
-    book.renter_name = ''
-    book.rented_time = None
-    book.category = form.category.data
+    if count:
+        db.session.bulk_insert_mappings(Book, [dict(title_id=title_id) for i in range(count)])
+        Title.query.filter(Title.id == title_id) \
+            .update({Title.total_copies: Title.total_copies + count,
+                     Title.available_copies: Title.available_copies + count},
+                    synchronize_session=False)
+
+def save_changes( title, form, new = False):
+    """
+    Save the changes to a given title, adding the copies asked for
+    """
+    global search_indexes_version
+    old_values = None if new else suggestions.values(title)
+    title.title = form.title.data
+    title.publisher = form.publisher.data
+    title.author = form.author.data
+    title.isbn13 = form.isbn13.data
+    title.category = form.category.data
 
     if new:
-        # Add the book to the database
-        db.session.add(book)
-
+        # Add the title to the database
+        db.session.add(title)
+
+    new_values = suggestions.values(title)
+    bump_catalog_version(titles=new_values != old_values)
+    db.session.flush()
+    title_id = title.id
+    add_copies(title_id, form.new_copies.data)
+    # Read within the transaction, so this change included
+    version = titles_version()
     db.session.commit()
 
+    # Indexes not loaded yet will read the title from the database, and
+    # indexes missing changes of other processes are built again on their
+    # next search. Only the ones just before this change are updated.
+    with search_indexes_lock:
+        if new_values == old_values or search_indexes_version != version - 1:
+            return
+        if old_values:
+            suggestions.remove(old_values)
+            fuzzy_index.remove(title_id, old_values)
+        suggestions.add(new_values)
+        fuzzy_index.add(title_id, new_values)
+        search_indexes_version = version
+
+
+# The in-memory search indexes are built by each process on first use, and
+# built again once the titles version has moved, as when another process
+# imported books. None until they are built.
+search_indexes_version = None
+search_indexes_lock = RLock()
+
+def load_search_indexes():
+    """
+    Build the in-memory autocomplete and fuzzy search indexes from the titles table
+    """
+    global search_indexes_version
+    with search_indexes_lock:
+        # Read before the titles: a change committed in between is in the
+        # indexes, and only makes the next search build them again
+        version = db.session.query(CatalogVersion.titles_version) \
+            .filter(CatalogVersion.id == 1).scalar()
+        titles = db.session.query(Title.id, Title.title, Title.author, Title.publisher).all()
+        suggestions.build(titles)
+        fuzzy_index.build(titles)
+        search_indexes_version = version
+
+def search_indexes():
+    """
+    Return the (autocomplete, fuzzy search) indexes, loading them if they
+    are older than the titles read by this request
+    """
+    version = titles_version()
+    if search_indexes_version is None or search_indexes_version < version:
+        with search_indexes_lock:
+            if search_indexes_version is None or search_indexes_version < version:
+                load_search_indexes()
+    return suggestions, fuzzy_index
+
+
+categories = dict(book_categories)
 
 class CategoryCol(Col):
     def td_format(self,content):
-        values=dict(book_categories)
-        if values[content] is not None:
-            return values[content]
-        else: 
-            return _l(u'Unknown Category')
+        return categories.get(content, _l(u'Unknown Category'))
 
-class BookResults(Table):
+class BookResults(SortableTable):
     classes = ['table']
     id = Col('Id', show=False)
     title = Col(_l(u'Title'))
@@ -119,18 +347,126 @@ class BookResults(Table):
     author = Col(_l(u'Author'))
     isbn13 = Col('ISBN 13')
     category = CategoryCol(_l(u'Category'))
+    available_copies = Col(_l(u'Available'))
+    total_copies = Col(_l(u'Copies'), allow_sort=False)
+    rent = ButtonCol(_l(u'Rent / Give Back'), '.rent_title', url_kwargs=dict(id='id'), allow_sort=False)
+
+class AdminBookResults(BookResults):
+    edit = LinkCol(_l(u'Edit'),'.edit',url_kwargs=dict(id='id'), allow_sort=False)
+
+class CopyResults(Table):
+    classes = ['table']
+    id = Col('Id')
     renter_name = Col(_l(u'Renter'))
     rented_time = DatetimeCol(_l(u'Rented time'))
     rent = ButtonCol(_l(u'Rent / Give Back'), '.rent', url_kwargs=dict(id='id'))
 
+
+# Columns the book tables can be sorted on. Nullable columns are coalesced so
+# that the keyset comparisons below never have to deal with NULLs.
+sort_columns = {
+    'id': Title.id,
+    'title': Title.title,
+    'publisher': Title.publisher,
+    'author': func.coalesce(Title.author, ''),
+    'isbn13': Title.isbn13,
+    'category': Title.category,
+    'available_copies': Title.available_copies,
+}
+
+def paginate_books(qry, columns=sort_columns, default='id'):
+    """
+    Return one page of the titles of qry, see paginate
+    """
+    return paginate(qry, columns, default, Title.id, current_app.config['BOOKS_PER_PAGE'])
+
+# Rendered book table along with its pager, the table is None if there are
+# no books to list
+Fragment = namedtuple('Fragment', ['table', 'prev_url', 'next_url'])
+
+# Number of rendered book tables kept in memory
+BOOK_TABLE_CACHE_SIZE = 512
+
+fragment_cache = LRUCache(BOOK_TABLE_CACHE_SIZE)
+
+def render_fragment(page, admin, border=False):
+    if not page.items:
+        return Fragment(None, None, None)
+    table_class = AdminBookResults if admin else BookResults
+    table = table_class(page.items, sort_by=page.sort, sort_reverse=page.reverse, border=border)
+    return Fragment(Markup(table.__html__()), page.prev_url, page.next_url)
+
+def stream_books(qry, columns, admin, default='id', border=False):
+    """
+    Return all the titles of qry as a stream of table chunks, or None if
+    there are none
+    """
+    batches, sort, reverse = sorted_items(qry, columns, default, Title.id,
+                                          current_app.config['BOOKS_STREAM_BATCH_SIZE'])
+    if batches is None:
+        return None
+    table_class = AdminBookResults if admin else BookResults
+    table = table_class([], sort_by=sort, sort_reverse=reverse, border=border)
+    return stream_table(table, batches)
+
+def cached_fragment(render, admin):
+    """
+    Return the fragment of the current page from the cache, or render it.
+    Fragments are keyed by the catalog version so that any change of the
+    books renders them again.
+    """
+    key = (catalog_version(), request.endpoint,
+           tuple(sorted(request.view_args.items())),
+           tuple(sorted(request.args.items(multi=True))),
+           str(get_locale()), admin)
+    fragment = fragment_cache.get(key)
+    if fragment is None:
+        fragment = render()
+        fragment_cache.set(key, fragment)
+    return fragment
+
+def conditional_on_catalog(view):
+    """
+    Answer GET requests for an unchanged catalog page with a 304, before
+    running the view. The ETag covers the catalog version and everything
+    else the page depends on: the user (shown in the navbar), its roles,
+    its locale and the URL.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Pages showing flashed messages are never reused
+        if request.method != 'GET' or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        version, modified = catalog_state()[:2]
+        etag = hashlib.sha1(repr((version, current_user.id, current_user.has_roles('Admin'),
+                                  str(get_locale()), request.full_path)).encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.last_modified = modified
+        # Let the browser keep the page, but check it is current every time
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
 @bp.route('/', methods=['GET', 'POST'])
 @login_required
+@conditional_on_catalog
 def index():
-    results = Book.query.all()
-    table = BookResults(results)#, no_items=_l(u'No books in the database'))
-    if current_user.has_roles('Admin'):
-        table.add_column('edit', LinkCol(_l(u'Edit'),'.edit',url_kwargs=dict(id='id')))
-    return render_template('books/index.html', table=table)
+    admin = current_user.has_roles('Admin')
+    if request.args.get('all', type=int):
+        table = stream_books(Title.query, sort_columns, admin)
+        return stream_template('books/index.html', table=table, page=Fragment(None, None, None))
+
+    fragment = cached_fragment(lambda: render_fragment(paginate_books(Title.query), admin), admin)
+    return render_template('books/index.html', table=fragment.table, page=fragment,
+                           all_url=all_url())
 
     
  
@@ -139,86 +475,415 @@ def index():
 def search():
     search = BookSearchForm()
     if search.validate_on_submit():
-        return redirect(url_for('.search_results', search_string=search.search.data))
+        return redirect(url_for('.search_results', search_string=search.search.data,
+                                fuzzy=1 if search.fuzzy.data else None))
  
     return render_template('books/search.html', form=search)
 
+@bp.route('/suggest')
+@login_required
+def suggest():
+    """
+    Return the titles, authors and publishers starting with the 'q' prefix
+    as JSON, for the search box autocomplete
+    """
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    results = search_indexes()[0].suggest(request.args.get('q', ''), limit)
+    return jsonify([dict(field=field, value=value) for field, value in results])
+
 @bp.route('/results/<string:search_string>', methods=['GET', 'POST'])
 @bp.route('/results/', methods=['GET', 'POST'])
 @bp.route('/results', methods=['GET', 'POST'])
 @login_required
+@conditional_on_catalog
 def search_results(search_string=None):
     results = []
     search = BookSearchForm()
 
     if search.validate_on_submit():
-        return redirect(url_for('.search_results', search_string=search.search.data))
-
-    if search_string:
-        search_string_list = search_string.split(' ')
-        qry=Book.query.filter(Book.title.contains(search_string))
-        for string in search_string_list:
-            subquery = Book.query.filter(or_(Book.title.contains(string),
-                                        Book.author.contains(string),
-                                        Book.publisher.contains(string),
-                                        Book.isbn13.contains(string),
-                                        Book.category.contains(string)))
-            qry = qry.union(subquery)
-        results = qry.all()
+        return redirect(url_for('.search_results', search_string=search.search.data,
+                                fuzzy=1 if search.fuzzy.data else None))
+
+    fuzzy = request.args.get('fuzzy', 0, type=int)
+    words = search_words(search_string)
+    admin = current_user.has_roles('Admin')
+
+    if request.args.get('all', type=int):
+        qry, columns, default = search_query(search_string, words, fuzzy)
+        table = stream_books(qry, columns, admin, default, border=True)
+        fragment = Fragment(table, None, None)
     else:
-        results = Book.query.all()
- 
-    if not results:
+        def render():
+            qry, columns, default = search_query(search_string, words, fuzzy)
+            return render_fragment(paginate_books(qry, columns, default), admin, border=True)
+        fragment = cached_fragment(render, admin)
+
+    if fragment.table is None and words and not fuzzy and not request.args:
+        # Nothing matches exactly, look for near matches instead
+        return redirect(url_for('.search_results', search_string=search_string, fuzzy=1))
+    elif fragment.table is None:
         message = gettext(u'No results found!') 
         flash(message,'info')
         return redirect(url_for('.search'))
     else:
         # display results
-        table = BookResults(results)
         search.search.data = search_string
-        if current_user.has_roles('Admin'):
-            table.add_column('edit', LinkCol(_l(u'Edit'),'.edit',url_kwargs=dict(id='id')))
-        table.border = True
-        return render_template('books/results.html', table=table, form=search)
+        search.fuzzy.data = bool(fuzzy)
+        if request.args.get('all', type=int):
+            return stream_template('books/results.html', table=fragment.table, form=search,
+                                   page=fragment)
+        return render_template('books/results.html', table=fragment.table, form=search,
+                               page=fragment, all_url=all_url())
+
+def search_query(search_string, words, fuzzy):
+    """
+    Return the query of the titles matching a search, with the columns it
+    can be sorted on and its default sort
+    """
+    matches = fts_match(words) if words and not fuzzy else None
+    if words and fuzzy:
+        scores = search_indexes()[1].search(search_string,
+                                            current_app.config['FUZZY_SEARCH_THRESHOLD'],
+                                            current_app.config['FUZZY_SEARCH_LIMIT'])
+        qry = Title.query.filter(Title.id.in_([title_id for title_id, score in scores]))
+        columns, default = sort_columns, 'id'
+        if scores:
+            rank = case(dict((title_id, -score) for title_id, score in scores), value=Title.id)
+            columns, default = dict(sort_columns, rank=rank), 'rank'
+    elif matches is not None:
+        qry = Title.query.join(matches, matches.c.rowid == Title.id)
+        columns, default = dict(sort_columns, rank=matches.c.rank), 'rank'
+    elif words:
+        # Without a full-text index, scan the table once for all the words
+        qry = Title.query.filter(or_(*[or_(Title.title.contains(word),
+                                           Title.author.contains(word),
+                                           Title.publisher.contains(word),
+                                           Title.isbn13.contains(word),
+                                           Title.category.contains(word))
+                                       for word in words]))
+        columns, default = sort_columns, 'id'
+    elif search_string:
+        qry = Title.query.filter(Title.title.contains(search_string))
+        columns, default = sort_columns, 'id'
+    else:
+        qry = Title.query
+        columns, default = sort_columns, 'id'
+    return qry, columns, default
 
 @bp.route('/item/<int:id>', methods=['GET', 'POST'])
 @roles_required('Admin')
 def edit(id):
-    qry = db.session.query(Book).filter(Book.id==id)
-    book = qry.first()
+    qry = db.session.query(Title).filter(Title.id==id)
+    title = qry.first()
 
-    if book:
-        form = BookForm(formdata=request.form, obj=book)
+    if title:
+        form = BookForm(formdata=request.form, obj=title, new_copies=0)
         if request.method == 'POST' and form.validate():
             # Save modifications
-            save_changes(book, form)
-            flash(_l(u'Book updated successfully!'),'success')
+            save_changes(title, form)
+            flash(gettext(u'Book updated successfully!'),'success')
             return redirect('/')
-        return render_template('books/edit_book.html', form=form)
+        copies = CopyResults(Book.query.filter(Book.title_id == id).order_by(Book.id).all())
+        return render_template('books/edit_book.html', form=form, copies=copies)
     else:
         flash(_l(u'ERROR Book #{id} doesn''t exist').format(id=id))
         return redirect(url_for('.index'))
 
+def is_available(book=Book):
+    """
+    Condition of a book (or an alias of Book) not being rented. Books saved
+    before renter_name was reset to NULL have an empty renter.
+    """
+    return or_(book.renter_name.is_(None), book.renter_name == '')
+
+def rent_book(id, username, user_id):
+    """
+    Give the book #id back if username rents it, or else rent it to
+    username, each with a conditional UPDATE so that concurrent checkouts of
+    the same book cannot both succeed. The one that matched a row tells
+    which happened, with no read in between. Return False if the book is
+    rented by someone else or doesn't exist.
+    """
+    now = datetime.datetime.now()
+    if Book.query.filter(Book.id == id, Book.renter_name == username) \
+            .update({Book.renter_name: null(), Book.rented_time: null()},
+                    synchronize_session=False):
+        bump_catalog_version()
+        record_return(id, now)
+        return True
+    if Book.query.filter(Book.id == id, is_available()) \
+            .update({Book.renter_name: username, Book.rented_time: now},
+                    synchronize_session=False):
+        bump_catalog_version()
+        record_checkout(id, user_id, now)
+        return True
+    return False
+
+def rent_title_copy(id, username, user_id):
+    """
+    Give back the copy of the title #id rented by username, or else rent one
+    of its available copies. Return False if no copy could be rented.
+    """
+    own_copy_first = case([(Book.renter_name == username, 0)], else_=1)
+    copies = db.session.query(Book.id) \
+        .filter(Book.title_id == id, or_(Book.renter_name == username, is_available())) \
+        .order_by(own_copy_first, Book.id).all()
+    # A copy rented by someone else meanwhile is skipped for the next one
+    return any(rent_book(book_id, username, user_id) for book_id, in copies)
+
 @bp.route('/rent_item/<int:id>', methods=['GET', 'POST'])
 @login_required
 def rent(id):
-    qry = db.session.query(Book).filter(Book.id==id)
-    book = qry.first()
-
-    if book:
-        import datetime
-        if book.renter_name == current_user.username:
-            book.renter_name = None
-            book.rented_time = None
-            db.session.commit()
-        elif book.renter_name is None:
-            qry = db.session.query(User).filter(User.id==current_user.id)
-            user = qry.first()
-            book.renter_name = user.username
-            book.rented_time = datetime.datetime.now()
-            db.session.commit()
+    if rent_book(id, current_user.username, current_user.id):
+        db.session.commit()
+    else:
+        db.session.rollback()
+        title = db.session.query(Title.title).join(Book, Book.title_id == Title.id) \
+            .filter(Book.id == id).scalar()
+        if title is not None:
+            flash(_l(u'ERROR Book {title} is already rented by someone else.').format(title=title))
         else:
-            flash(_l(u'ERROR Book {title} is already rented by someone else.').format(title=book.title))
+            flash(_l(u'ERROR Book #{id} doesn''t exist').format(id=id))
+    return redirect(url_for('.index'))
+
+@bp.route('/rent_title/<int:id>', methods=['GET', 'POST'])
+@login_required
+def rent_title(id):
+    if rent_title_copy(id, current_user.username, current_user.id):
+        db.session.commit()
     else:
-        flash(_l(u'ERROR Book #{id} doesn''t exist').format(id=id))
-    return redirect(url_for('.index'))
\ No newline at end of file
+        db.session.rollback()
+        title = db.session.query(Title.title).filter(Title.id == id).scalar()
+        if title is not None:
+            flash(_l(u'ERROR No copy of {title} is available.').format(title=title))
+        else:
+            flash(_l(u'ERROR Book #{id} doesn''t exist').format(id=id))
+    return redirect(url_for('.index'))
+
+
+def checkout_books(username, user_id, scans, give_back=False):
+    """
+    Rent (or give back) each scanned book to username, a scan being either a
+    book id or an ISBN 13, in which case any available copy of the title is
+    rented. Every book is handled by one conditional UPDATE, recorded in the
+    rental history and the counters of its title, and the caller commits
+    them all at once. Return the status of each scan.
+    """
+    now = datetime.datetime.now()
+    if give_back:
+        condition = lambda book: book.renter_name == username
+        values = {Book.renter_name: None, Book.rented_time: None}
+        done = 'returned'
+    else:
+        condition = is_available
+        values = {Book.renter_name: username, Book.rented_time: now}
+        done = 'rented'
+
+    results = []
+    changed = False
+    for scan in scans:
+        scan = str(scan).strip()
+        if len(scan) == 13 and scan.isdigit():
+            known = Book.title_id.in_(select([Title.id]).where(Title.isbn13 == scan))
+        # Larger numbers overflow the 64 bit integers of the database
+        elif scan.isdecimal() and int(scan) < 2 ** 63:
+            known = Book.id == int(scan)
+        else:
+            results.append(dict(book=scan, status='invalid'))
+            continue
+
+        status = None
+        for book_id, in db.session.query(Book.id).filter(known, condition(Book)) \
+                .order_by(Book.id).all():
+            # A copy taken meanwhile by another checkout is skipped for the next one
+            if Book.query.filter(Book.id == book_id, condition(Book)) \
+                    .update(values, synchronize_session=False):
+                if give_back:
+                    record_return(book_id, now)
+                else:
+                    record_checkout(book_id, user_id, now)
+                status = done
+                changed = True
+                break
+        if status is None:
+            if db.session.query(Book.query.filter(known).exists()).scalar():
+                status = 'unavailable'
+            else:
+                status = 'not_found'
+        results.append(dict(book=scan, status=status))
+    if changed:
+        bump_catalog_version()
+    return results
+
+@bp.route('/checkout', methods=['POST'])
+@roles_required('Admin')
+def checkout():
+    """
+    Checkout station API: rent or give back a batch of scanned books for the
+    user whose badge was scanned, in a single transaction. Expects a JSON
+    object with the 'user' UUID, the list of 'books' ids or ISBN 13 and an
+    optional 'action', 'rent' (default) or 'return'.
+    """
+    data = request.get_json(silent=True)
+    # Any other JSON value is answered like a missing body
+    if not isinstance(data, dict):
+        data = {}
+    action = data.get('action', 'rent')
+    scans = data.get('books')
+    try:
+        userid = uuid.UUID(str(data.get('user')))
+    except ValueError:
+        userid = None
+    if userid is None or action not in ('rent', 'return') or not isinstance(scans, list):
+        return jsonify(error='Expected a user UUID, a list of books and a rent or return action'), 400
+
+    username = db.session.query(User.username).filter(User.id == userid).scalar()
+    if username is None:
+        return jsonify(error='Unknown user {}'.format(userid.hex)), 404
+
+    results = checkout_books(username, userid, scans, give_back=action == 'return')
+    db.session.commit()
+    return jsonify(user=username, action=action, books=results)
+
+
+import_columns = ('title', 'publisher', 'author', 'isbn13', 'category')
+
+def import_books(fp, on_error, batch_size=1000):
+    """
+    Import the books of a CSV file with a title, publisher, author, isbn13,
+    category and optional copies header. Rows are read one at a time and
+    inserted in batches of batch_size, so memory stays flat whatever the
+    size of the file. The copies of a row whose ISBN 13 is already in the
+    catalog or earlier in the file are added to that title. Invalid rows are
+    skipped and reported through on_error(line, message). Return the number
+    of copies imported.
+    """
+    categories = dict(book_categories)
+    reader = csv.DictReader(fp)
+    missing = [column for column in ('title', 'publisher', 'category')
+               if column not in (reader.fieldnames or [])]
+    if missing:
+        on_error(1, gettext(u'Missing columns: {}').format(', '.join(missing)))
+        return 0
+
+    count = 0
+    batch = []
+    batch_isbns = {}
+
+    def insert(batch):
+        # Titles already in the catalog, including the ones of the batches
+        # inserted before, only get more copies
+        isbns = [title['isbn13'] for title, copies in batch if title['isbn13']]
+        existing = dict(db.session.query(Title.isbn13, Title.id)
+                                  .filter(Title.isbn13.in_(isbns)))
+        mappings = [dict(title, total_copies=copies, available_copies=copies)
+                    for title, copies in batch if title['isbn13'] not in existing]
+        # Bumped first, its row lock keeps other writers of titles out until
+        # the commit, so the new titles are the ones after the last id, in
+        # the order they were inserted
+        bump_catalog_version(titles=True)
+        last_id = db.session.query(func.max(Title.id)).scalar() or 0
+        db.session.bulk_insert_mappings(Title, mappings)
+        title_ids = [id for id, in db.session.query(Title.id)
+                                             .filter(Title.id > last_id).order_by(Title.id)]
+        db.session.bulk_insert_mappings(Book, [dict(title_id=title_id)
+                                               for title_id, title in zip(title_ids, mappings)
+                                               for i in range(title['total_copies'])])
+        for title, copies in batch:
+            if title['isbn13'] in existing:
+                add_copies(existing[title['isbn13']], copies)
+        db.session.commit()
+        return sum(copies for title, copies in batch)
+
+    for line, row in enumerate(reader, 2):
+        title = dict((column, (row.get(column) or '').strip()) for column in import_columns)
+        title['author'] = title['author'] or None
+        copies = (row.get('copies') or '1').strip()
+        error = None
+        if not title['title'] or not title['publisher']:
+            error = gettext(u'Title and publisher are required')
+        elif title['category'] not in categories:
+            error = gettext(u'Unknown category {}').format(title['category'])
+        elif not copies.isdigit() or not 1 <= int(copies) <= 1000:
+            error = gettext(u'Invalid number of copies {}').format(copies)
+        elif title['isbn13']:
+            error = isbn13_error(title['isbn13'], checksum=True)
+        if error:
+            on_error(line, error)
+            continue
+
+        if title['isbn13'] in batch_isbns:
+            batch_isbns[title['isbn13']][1] += int(copies)
+            continue
+        entry = [title, int(copies)]
+        batch.append(entry)
+        if title['isbn13']:
+            batch_isbns[title['isbn13']] = entry
+        if len(batch) >= batch_size:
+            count += insert(batch)
+            batch = []
+            batch_isbns = {}
+    if batch:
+        count += insert(batch)
+
+    # Built again here at once, the other processes build theirs on their
+    # next search since the titles version has moved
+    if count:
+        load_search_indexes()
+    return count
+
+@bp.route('/import', methods=['GET', 'POST'])
+@roles_required('Admin')
+def import_csv():
+    """
+    Import books from an uploaded CSV file
+    """
+    form = BookImportForm()
+    errors = []
+
+    if form.validate_on_submit():
+        # Only the first errors are displayed, the file may be garbage
+        def on_error(line, message):
+            if len(errors) < 1000:
+                errors.append((line, message))
+
+        fp = codecs.getreader('utf-8-sig')(form.file.data.stream)
+        count = import_books(fp, on_error, current_app.config['BOOKS_IMPORT_BATCH_SIZE'])
+        flash(_l(u'{count} books imported').format(count=count), 'success')
+
+    return render_template('books/import.html', form=form, errors=errors)
+
+@bp.cli.command('import')
+@click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--batch-size', type=int, help='Number of books inserted per transaction.')
+def import_command(file, batch_size):
+    """Import books from a CSV file."""
+    def on_error(line, message):
+        click.echo(u'Line {}: {}'.format(line, message), err=True)
+
+    count = import_books(file, on_error,
+                         batch_size or current_app.config['BOOKS_IMPORT_BATCH_SIZE'])
+    click.echo('{} books imported'.format(count))
+
+
+def export_query():
+    return db.session.query(Book.id, Title.title, Title.publisher, Title.author,
+                            Title.isbn13, Title.category, Book.renter_name,
+                            Book.rented_time).join(Title, Title.id == Book.title_id) \
+        .order_by(Book.id)
+
+@bp.route('/export.<any(csv, ndjson):fmt>')
+@roles_required('Admin')
+def export(fmt):
+    """
+    Download the whole catalog, with its rental state, as CSV or NDJSON
+    """
+    return export_response(export_query(), fmt, 'books')
+
+@bp.cli.command('export')
+@click.option('--format', 'fmt', type=click.Choice(sorted(export_formats)), default='csv')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-',
+              help='File the books are written to, standard output by default.')
+def export_command(fmt, output):
+    """Export the books and their rental state."""
+    export_file(export_query(), fmt, output)
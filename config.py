@@ -8,10 +8,56 @@ class Config(object):
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    #Database settings
+    SQLITE_BUSY_TIMEOUT = 30000     # Milliseconds a write waits for the lock held by another
+    SQLITE_SYNCHRONOUS = 'NORMAL'   # Sync on checkpoints only, FULL to sync every commit
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the database read through mmap
+    # Connection pool of client/server databases such as PostgreSQL, per process
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 5)
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW') or 10)
+    DATABASE_POOL_RECYCLE = 1800    # Seconds before a connection is replaced
+    DATABASE_POOL_TIMEOUT = 30      # Seconds a request waits for a free connection
+
+    #Metrics settings
+    METRICS_ENABLED = True          # Instrument the requests, served at /metrics to admins
+    # Seconds from which a query is logged to the slow_queries logger, None to log none
+    SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD') or 0) or None
+
     #Flask-User settings
     USER_ENABLE_USERNAME = True    # Enable username authentication
     USER_ENABLE_EMAIL = False      # Disable email authentication
     USER_APP_NAME = 'TMDB'
+    USERS_PER_PAGE = int(os.environ.get('USERS_PER_PAGE') or 50)
+    USER_CACHE_TTL = 60            # Seconds other processes may serve stale users and roles
+    # bcrypt cost, each step doubles the hashing time. Passwords hashed with
+    # another cost are hashed again when their user logs in.
+    PASSWORD_ROUNDS = int(os.environ.get('PASSWORD_ROUNDS') or 12)
+    USER_PASSLIB_CRYPTCONTEXT_KEYWORDS = dict(bcrypt__default_rounds=PASSWORD_ROUNDS,
+                                              bcrypt__min_rounds=PASSWORD_ROUNDS,
+                                              bcrypt__max_rounds=PASSWORD_ROUNDS)
+    # Processes hashing the passwords, defaults to the number of CPUs, 0 to
+    # hash in the request thread
+    PASSWORD_HASH_PROCESSES = int(os.environ['PASSWORD_HASH_PROCESSES']) \
+        if os.environ.get('PASSWORD_HASH_PROCESSES') else None
+    PASSWORD_HASH_QUEUE = 64       # Hashings waiting for a process before answering 503
+    PASSWORD_HASH_TIMEOUT = 10     # Seconds a hashing may wait before answering 503
+    # bcrypt cost of the initial passwords of provisioned users, hashed again
+    # at PASSWORD_ROUNDS when their user first logs in
+    PASSWORD_INITIAL_ROUNDS = int(os.environ.get('PASSWORD_INITIAL_ROUNDS') or min(10, PASSWORD_ROUNDS))
+    USERS_PROVISION_BATCH_SIZE = 500  # Users inserted per transaction by the roster provisioning
+
+    #Books settings
+    BOOKS_PER_PAGE = int(os.environ.get('BOOKS_PER_PAGE') or 50)
+    FUZZY_SEARCH_THRESHOLD = 0.3    # Minimal trigram similarity of a near match
+    FUZZY_SEARCH_LIMIT = 200        # Maximal number of near matches listed
+    BOOKS_IMPORT_BATCH_SIZE = 1000  # Books inserted per transaction by the CSV import
+    EXPORT_BATCH_SIZE = 1000        # Rows fetched at once by the exports
+    BOOKS_STREAM_BATCH_SIZE = 500   # Rows fetched at once by the 'show all' book lists
+    RENTAL_LOAN_DAYS = int(os.environ.get('RENTAL_LOAN_DAYS') or 21)  # Days before a rented book is overdue
+
+    #Labels settings
+    LABEL_CACHE_DIR = os.path.join(basedir, 'cache', 'labels')
+    LABEL_PROCESSES = None          # Label rendering processes, defaults to the number of CPUs
 
     #Babel settings
     BABEL_DEFAULT_LOCALE = 'fr'
@@ -1,4 +1,53 @@
+# Database engine setup: connection pool settings for client/server databases
+# and pragmas letting several processes write to a SQLite database
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+import sqlite3
 
+# Pragmas run on every new SQLite connection, set by init_app
+sqlite_pragmas = []
 
 
+def engine_options(config):
+    """
+    Return the SQLAlchemy engine options of the database of config
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite':
+        # Each SQLite connection is a file handle, there is nothing to pool
+        return {}
+    return dict(
+        pool_size=config['DATABASE_POOL_SIZE'],
+        max_overflow=config['DATABASE_MAX_OVERFLOW'],
+        pool_recycle=config['DATABASE_POOL_RECYCLE'],
+        pool_timeout=config['DATABASE_POOL_TIMEOUT'],
+        # Replace the connections the server closed instead of failing a request
+        pool_pre_ping=True,
+    )
 
+
+def init_app(app):
+    """
+    Set up the database engine of app, before Flask-SQLAlchemy creates it
+    """
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    sqlite_pragmas[:] = [
+        # Readers no longer block the writer nor the writer the readers
+        'PRAGMA journal_mode=WAL',
+        # Safe with WAL: a power loss may only lose the last commits
+        'PRAGMA synchronous={}'.format(app.config['SQLITE_SYNCHRONOUS']),
+        # Wait for the write lock instead of failing with "database is locked"
+        'PRAGMA busy_timeout={:d}'.format(app.config['SQLITE_BUSY_TIMEOUT']),
+        'PRAGMA mmap_size={:d}'.format(app.config['SQLITE_MMAP_SIZE']),
+    ]
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma in sqlite_pragmas:
+        cursor.execute(pragma)
+    cursor.close()
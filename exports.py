@@ -0,0 +1,67 @@
+from flask import Response, current_app, stream_with_context
+import csv
+import datetime
+import io
+import json
+import uuid
+
+export_formats = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return value.hex
+    return value
+
+
+def export_rows(qry, fmt, batch_size=None):
+    """
+    Yield the rows of a query over columns as CSV or NDJSON text, one chunk
+    per batch of rows. Rows are fetched with yield_per so that only one
+    batch is ever in memory.
+    """
+    batch_size = batch_size or current_app.config['EXPORT_BATCH_SIZE']
+    names = [description['name'] for description in qry.column_descriptions]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(names)
+
+    count = 0
+    for row in qry.yield_per(batch_size):
+        values = [export_value(value) for value in row]
+        if fmt == 'csv':
+            writer.writerow(values)
+        else:
+            buffer.write(json.dumps(dict(zip(names, values))))
+            buffer.write('\n')
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_response(qry, fmt, filename):
+    """
+    Stream the export of a query as a downloadable file
+    """
+    response = Response(stream_with_context(export_rows(qry, fmt)),
+                        mimetype=export_formats[fmt])
+    response.headers['Content-Disposition'] = \
+        'attachment; filename={}.{}'.format(filename, fmt)
+    return response
+
+
+def export_file(qry, fmt, fp):
+    """
+    Write the export of a query to a file object
+    """
+    for chunk in export_rows(qry, fmt):
+        fp.write(chunk)
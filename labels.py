@@ -0,0 +1,94 @@
+from app import db
+from flask import Blueprint, current_app, render_template, request
+from flask_user import roles_required
+from auth import Role, User, UserRoles
+from books import Book, Title
+from barcodes import label_pages, render_labels
+import click
+import os
+
+bp = Blueprint('labels', __name__, url_prefix='/labels')
+
+
+def user_labels(role=None):
+    """
+    Return the (UUID, username) badge labels of all users, or of the users
+    having the given role
+    """
+    qry = db.session.query(User.id, User.username)
+    if role:
+        qry = qry.join(UserRoles, UserRoles.user_id == User.id) \
+            .join(Role, Role.id == UserRoles.role_id) \
+            .filter(Role.name == role)
+    return [(user.id.hex, user.username) for user in qry.order_by(User.username)]
+
+
+def book_labels(category=None, first=None, last=None):
+    """
+    Return the (id, title) spine labels of the books of a category and/or
+    within a range of ids
+    """
+    qry = db.session.query(Book.id, Title.title).join(Title, Title.id == Book.title_id)
+    if category:
+        qry = qry.filter(Title.category == category)
+    if first is not None:
+        qry = qry.filter(Book.id >= first)
+    if last is not None:
+        qry = qry.filter(Book.id <= last)
+    return [(str(book.id), book.title[:40]) for book in qry.order_by(Book.id)]
+
+
+def render_pages(labels):
+    return label_pages(render_labels(labels,
+                                     current_app.config['LABEL_CACHE_DIR'],
+                                     current_app.config['LABEL_PROCESSES']))
+
+
+def write_pages(pages, output):
+    os.makedirs(output, exist_ok=True)
+    for number, page in enumerate(pages, 1):
+        with open(os.path.join(output, 'page-{:03d}.svg'.format(number)), 'w', encoding='utf-8') as fp:
+            fp.write(page)
+    click.echo('{} pages written to {}'.format(len(pages), output))
+
+
+@bp.route('/users')
+@roles_required('Admin')
+def users():
+    """
+    Printable sheets of the user badges
+    """
+    pages = render_pages(user_labels(request.args.get('role')))
+    return render_template('labels/sheets.html', pages=pages)
+
+
+@bp.route('/books')
+@roles_required('Admin')
+def books():
+    """
+    Printable sheets of the book spine labels
+    """
+    pages = render_pages(book_labels(request.args.get('category'),
+                                     request.args.get('first', type=int),
+                                     request.args.get('last', type=int)))
+    return render_template('labels/sheets.html', pages=pages)
+
+
+@bp.cli.command('users')
+@click.option('--role', help='Only print the badges of the users having this role.')
+@click.option('--output', default='labels', type=click.Path(file_okay=False),
+              help='Directory where the SVG pages are written.')
+def users_command(role, output):
+    """Print the user badges as SVG label sheets."""
+    write_pages(render_pages(user_labels(role)), output)
+
+
+@bp.cli.command('books')
+@click.option('--category', help='Only print the labels of this category.')
+@click.option('--first', type=int, help='First book id to print.')
+@click.option('--last', type=int, help='Last book id to print.')
+@click.option('--output', default='labels', type=click.Path(file_okay=False),
+              help='Directory where the SVG pages are written.')
+def books_command(category, first, last, output):
+    """Print the book spine labels as SVG label sheets."""
+    write_pages(render_pages(book_labels(category, first, last)), output)
@@ -1,5 +1,6 @@
-from app import app, db, user_manager
-from flask import flash, render_template, request, redirect
+from app import create_app
+
+app = create_app()
 
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    app.run()
@@ -0,0 +1,181 @@
+# Per request instrumentation: wall time, SQL queries and template rendering
+# time of each endpoint, aggregated in histograms served in the Prometheus
+# text format
+from flask import Blueprint, Response, current_app, g, has_request_context, request
+from flask import before_render_template, template_rendered
+from flask_user import roles_required
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from bisect import bisect_left
+from threading import Lock
+import logging
+import time
+
+bp = Blueprint('metrics', __name__)
+
+slow_query_logger = logging.getLogger('slow_queries')
+
+# Upper bounds of the buckets of the histograms
+seconds_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+queries_buckets = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+histograms = [
+    ('http_request_duration_seconds', 'Wall time of the requests', seconds_buckets),
+    ('http_request_sql_queries', 'SQL queries run by a request', queries_buckets),
+    ('http_request_sql_duration_seconds', 'Time spent running SQL queries by a request', seconds_buckets),
+    ('http_request_template_duration_seconds', 'Time spent rendering templates by a request', seconds_buckets),
+]
+
+
+class Histograms(object):
+    """
+    Histograms of the requests by metric and endpoint, plus a count of the
+    requests by endpoint and status. Each process has its own.
+    """
+
+    def __init__(self):
+        self.buckets = dict((name, buckets) for name, help, buckets in histograms)
+        self.values = {}
+        self.statuses = {}
+        self.lock = Lock()
+
+    def observe(self, endpoint, status, observations):
+        """
+        Record the {metric: value} observations of one request
+        """
+        with self.lock:
+            key = (endpoint, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+            for name, value in observations.items():
+                buckets = self.buckets[name]
+                counts = self.values.get((name, endpoint))
+                if counts is None:
+                    # One count per bucket plus +Inf, then the sum
+                    counts = self.values[(name, endpoint)] = [0] * (len(buckets) + 1) + [0.0]
+                counts[bisect_left(buckets, value)] += 1
+                counts[-1] += value
+
+    def render(self):
+        """
+        Return the histograms in the Prometheus text format
+        """
+        with self.lock:
+            values = dict((key, list(counts)) for key, counts in self.values.items())
+            statuses = dict(self.statuses)
+
+        lines = [
+            '# HELP http_requests_total Requests by endpoint and status',
+            '# TYPE http_requests_total counter',
+        ]
+        for (endpoint, status), count in sorted(statuses.items()):
+            lines.append('http_requests_total{{endpoint="{}",status="{}"}} {}'.format(
+                endpoint, status, count))
+
+        for name, help, buckets in histograms:
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} histogram'.format(name))
+            for (metric, endpoint), counts in sorted(values.items()):
+                if metric != name:
+                    continue
+                total = 0
+                for bound, count in zip(buckets + ('+Inf',), counts):
+                    total += count
+                    lines.append('{}_bucket{{endpoint="{}",le="{}"}} {}'.format(
+                        name, endpoint, bound, total))
+                lines.append('{}_sum{{endpoint="{}"}} {}'.format(name, endpoint, counts[-1]))
+                lines.append('{}_count{{endpoint="{}"}} {}'.format(name, endpoint, total))
+        return '\n'.join(lines) + '\n'
+
+
+request_histograms = Histograms()
+
+
+class RequestMetrics(object):
+    """
+    Counters of the current request, kept in g
+    """
+    __slots__ = ('start', 'sql_queries', 'sql_duration', 'template_duration', 'template_starts')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_queries = 0
+        self.sql_duration = 0.0
+        self.template_duration = 0.0
+        self.template_starts = []
+
+
+def current_metrics():
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+
+def start_request():
+    g.request_metrics = RequestMetrics()
+
+def end_request(response):
+    metrics = g.pop('request_metrics', None)
+    if metrics is not None:
+        request_histograms.observe(request.endpoint or 'unmatched', response.status_code, {
+            'http_request_duration_seconds': time.perf_counter() - metrics.start,
+            'http_request_sql_queries': metrics.sql_queries,
+            'http_request_sql_duration_seconds': metrics.sql_duration,
+            'http_request_template_duration_seconds': metrics.template_duration,
+        })
+    return response
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_starts', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_starts'].pop()
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.sql_queries += 1
+        metrics.sql_duration += duration
+        threshold = current_app.config['SLOW_QUERY_THRESHOLD']
+        if threshold is not None and duration >= threshold:
+            slow_query_logger.warning('%.3fs in %s: %s', duration, request.endpoint, statement)
+
+@event.listens_for(Engine, 'handle_error')
+def failed_query(context):
+    # There is no connection when connecting failed
+    starts = context.connection.info.get('query_starts') if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def start_template(sender, template, context, **extra):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.template_starts.append(time.perf_counter())
+
+def end_template(sender, template, context, **extra):
+    metrics = current_metrics()
+    if metrics is not None and metrics.template_starts:
+        metrics.template_duration += time.perf_counter() - metrics.template_starts.pop()
+
+
+def init_app(app):
+    """
+    Instrument the requests of app, if METRICS_ENABLED
+    """
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.before_request(start_request)
+    app.after_request(end_request)
+    before_render_template.connect(start_template, app)
+    template_rendered.connect(end_template, app)
+    app.register_blueprint(bp)
+
+
+@bp.route('/metrics')
+@roles_required('Admin')
+def metrics():
+    """
+    Serve the metrics of this process in the Prometheus text format
+    """
+    return Response(request_histograms.render(), mimetype='text/plain; version=0.0.4')
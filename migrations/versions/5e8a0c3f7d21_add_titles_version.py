@@ -0,0 +1,32 @@
+"""add titles version
+
+Revision ID: 5e8a0c3f7d21
+Revises: c41d2a9e5b07
+Create Date: 2026-10-18 22:03:47.209518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8a0c3f7d21'
+down_revision = 'c41d2a9e5b07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # flask init-db creates the table, with the column, on databases it
+    # didn't have
+    inspector = sa.inspect(op.get_bind())
+    if 'catalog_version' not in inspector.get_table_names() or \
+            'titles_version' in [column['name'] for column in inspector.get_columns('catalog_version')]:
+        return
+    op.add_column('catalog_version',
+                  sa.Column('titles_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('catalog_version') as batch_op:
+        batch_op.drop_column('titles_version')
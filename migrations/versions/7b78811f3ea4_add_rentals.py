@@ -0,0 +1,61 @@
+"""add rentals
+
+Revision ID: 7b78811f3ea4
+Revises: fbce0ea98edd
+Create Date: 2026-10-18 20:30:46.118487
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy_utils
+
+
+# revision identifiers, used by Alembic.
+revision = '7b78811f3ea4'
+down_revision = 'fbce0ea98edd'
+branch_labels = None
+depends_on = None
+
+
+open_rental = sa.text('return_time IS NULL')
+
+
+def upgrade():
+    # flask init-db creates the table on databases it didn't have
+    inspector = sa.inspect(op.get_bind())
+    if 'rentals' not in inspector.get_table_names():
+        op.create_table(
+            'rentals',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('book_id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sqlalchemy_utils.types.uuid.UUIDType(), nullable=False),
+            sa.Column('category', sa.String(), nullable=False),
+            sa.Column('checkout_time', sa.DateTime(), nullable=False),
+            sa.Column('return_time', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['book_id'], ['books.id'], ),
+            sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_rentals_open_book_id', 'rentals', ['book_id'], unique=True,
+                        sqlite_where=open_rental, postgresql_where=open_rental)
+        op.create_index('ix_rentals_open_checkout_time', 'rentals', ['checkout_time'],
+                        sqlite_where=open_rental, postgresql_where=open_rental)
+        op.create_index('ix_rentals_user_id_checkout_time', 'rentals', ['user_id', 'checkout_time'])
+        op.create_index('ix_rentals_category_checkout_time', 'rentals', ['category', 'checkout_time'])
+
+    # The books rented before the history existed start it, still out
+    if 'books' in inspector.get_table_names():
+        op.execute(
+            'INSERT INTO rentals (book_id, user_id, category, checkout_time) '
+            'SELECT books.id, users.id, books.category, books.rented_time '
+            'FROM books JOIN users ON users.username = books.renter_name '
+            'WHERE books.rented_time IS NOT NULL '
+            'AND NOT EXISTS (SELECT 1 FROM rentals)')
+
+
+def downgrade():
+    op.drop_index('ix_rentals_category_checkout_time', table_name='rentals')
+    op.drop_index('ix_rentals_user_id_checkout_time', table_name='rentals')
+    op.drop_index('ix_rentals_open_checkout_time', table_name='rentals')
+    op.drop_index('ix_rentals_open_book_id', table_name='rentals')
+    op.drop_table('rentals')
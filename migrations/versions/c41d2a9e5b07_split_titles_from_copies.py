@@ -0,0 +1,120 @@
+"""split titles from copies
+
+Revision ID: c41d2a9e5b07
+Revises: 7b78811f3ea4
+Create Date: 2026-10-18 21:12:05.441630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d2a9e5b07'
+down_revision = '7b78811f3ea4'
+branch_labels = None
+depends_on = None
+
+
+# Columns moving from the books to their titles
+title_columns = ['title', 'publisher', 'author', 'isbn13', 'category']
+
+# A book matches its title on every column, authors being optional
+same_title = (
+    'titles.title = books.title AND titles.publisher = books.publisher '
+    'AND (titles.author = books.author OR (titles.author IS NULL AND books.author IS NULL)) '
+    'AND titles.isbn13 = books.isbn13 AND titles.category = books.category')
+
+
+def drop_fts(name, table):
+    """
+    Drop a SQLite full-text index and its triggers, they are created again
+    by flask init-db on the new table
+    """
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for trigger in ('insert', 'delete', 'update'):
+        op.execute('DROP TRIGGER IF EXISTS {}_{}'.format(name, trigger))
+    op.execute('DROP TABLE IF EXISTS {}'.format(name))
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    # flask init-db creates both tables on databases it didn't have
+    if 'books' not in inspector.get_table_names() or \
+            'title_id' in [column['name'] for column in inspector.get_columns('books')]:
+        return
+
+    drop_fts('books_fts', 'books')
+
+    op.create_table(
+        'titles',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('publisher', sa.String(), nullable=False),
+        sa.Column('author', sa.String(), nullable=True),
+        sa.Column('isbn13', sa.String(length=13), nullable=False),
+        sa.Column('category', sa.String(), nullable=False),
+        sa.Column('total_copies', sa.Integer(), nullable=False),
+        sa.Column('available_copies', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_titles_isbn13', 'titles', ['isbn13'])
+    op.create_index('ix_titles_category', 'titles', ['category'])
+
+    # Books saved through the form before renter_name was reset to NULL
+    # have an empty renter, they are available
+    op.execute("UPDATE books SET renter_name = NULL, rented_time = NULL WHERE renter_name = ''")
+
+    # Identical books become the copies of one title, numbered in the order
+    # of their first copy
+    op.execute(
+        'INSERT INTO titles (title, publisher, author, isbn13, category, '
+        'total_copies, available_copies) '
+        'SELECT title, publisher, author, isbn13, category, COUNT(*), '
+        'SUM(CASE WHEN renter_name IS NULL THEN 1 ELSE 0 END) '
+        'FROM books GROUP BY title, publisher, author, isbn13, category '
+        'ORDER BY MIN(id)')
+
+    op.add_column('books', sa.Column('title_id', sa.Integer(), nullable=True))
+    op.execute('UPDATE books SET title_id = '
+               '(SELECT MIN(titles.id) FROM titles WHERE {})'.format(same_title))
+
+    existing = set(index['name'] for index in inspector.get_indexes('books'))
+    for name in ('ix_books_isbn13', 'ix_books_category'):
+        if name in existing:
+            op.drop_index(name, table_name='books')
+    with op.batch_alter_table('books') as batch_op:
+        for name in title_columns:
+            batch_op.drop_column(name)
+        batch_op.alter_column('title_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_index('ix_books_title_id', ['title_id'])
+        batch_op.create_foreign_key('fk_books_title_id_titles', 'titles', ['title_id'], ['id'])
+
+
+def downgrade():
+    drop_fts('titles_fts', 'titles')
+
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.add_column(sa.Column('title', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('publisher', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('author', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('isbn13', sa.String(length=13), nullable=True))
+        batch_op.add_column(sa.Column('category', sa.String(), nullable=True))
+
+    for name in title_columns:
+        op.execute('UPDATE books SET {0} = (SELECT titles.{0} FROM titles '
+                   'WHERE titles.id = books.title_id)'.format(name))
+
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.drop_constraint('fk_books_title_id_titles', type_='foreignkey')
+        batch_op.drop_index('ix_books_title_id')
+        batch_op.drop_column('title_id')
+        for name in ('title', 'publisher', 'isbn13', 'category'):
+            batch_op.alter_column(name, existing_type=sa.String(), nullable=False)
+    op.create_index('ix_books_isbn13', 'books', ['isbn13'])
+    op.create_index('ix_books_category', 'books', ['category'])
+
+    op.drop_index('ix_titles_category', table_name='titles')
+    op.drop_index('ix_titles_isbn13', table_name='titles')
+    op.drop_table('titles')
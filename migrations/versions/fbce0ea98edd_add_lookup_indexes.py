@@ -0,0 +1,56 @@
+"""add lookup indexes
+
+Revision ID: fbce0ea98edd
+Revises:
+Create Date: 2026-10-18 20:01:26.354050
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fbce0ea98edd'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# The tables are created by flask init-db, which also creates these indexes
+# on new databases, so only the missing ones are added
+indexes = [
+    ('ix_books_isbn13', 'books', ['isbn13'], False),
+    ('ix_books_renter_name', 'books', ['renter_name'], False),
+    ('ix_books_rented_time', 'books', ['rented_time'], False),
+    ('ix_books_category', 'books', ['category'], False),
+    ('ix_user_roles_user_id_role_id', 'user_roles', ['user_id', 'role_id'], True),
+]
+
+
+def existing_indexes(table):
+    """
+    Return the names of the indexes of table, None if there is no such table
+    """
+    inspector = sa.inspect(op.get_bind())
+    if table not in inspector.get_table_names():
+        return None
+    return set(index['name'] for index in inspector.get_indexes(table))
+
+
+def upgrade():
+    if existing_indexes('user_roles') is not None:
+        # A user can only have a role once
+        op.execute(
+            'DELETE FROM user_roles WHERE id NOT IN '
+            '(SELECT MIN(id) FROM user_roles GROUP BY user_id, role_id)')
+
+    for name, table, columns, unique in indexes:
+        existing = existing_indexes(table)
+        if existing is not None and name not in existing:
+            op.create_index(name, table, columns, unique=unique)
+
+
+def downgrade():
+    for name, table, columns, unique in reversed(indexes):
+        if name in (existing_indexes(table) or ()):
+            op.drop_index(name, table_name=table)
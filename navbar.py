@@ -5,35 +5,57 @@ from flask import (
         )
 from auth import register, userlist
 from books import index, search, new_book
-from flask_babelex import gettext
+from flask_babelex import gettext, get_locale
 from flask_user import current_user
+from markupsafe import Markup, escape
+import uuid
 
 nav = Nav()
 
+# Placeholders of the user specific parts of the navbar, substituted in the
+# cached HTML
+USERNAME = '__navbar_username__'
+USERID = uuid.UUID(int=0)
 
-@nav.navigation()
-def mynavbar():
-    if current_user.is_anonymous:
+
+class UserView(View):
+    """
+    View of a page of the current user, active on the user's own page
+    whatever the actual user id
+    """
+    @property
+    def active(self):
+        return request.endpoint == self.endpoint and \
+            (request.view_args or {}).get('userid') == current_user.id
+
+
+def build_navbar(role, username=USERNAME, userid=USERID):
+    if role == 'anonymous':
         navbar = Navbar(
             '',
             View(gettext(u'Login'),'user.login')
         )
-    elif current_user.has_roles('Admin'):
+    elif role == 'admin':
         navbar = Navbar(
             '',
             View(gettext(u'Home'),'books.index'),
             Subgroup(
                 gettext(u'Books'),
                 View(gettext(u'New Book'), 'books.new_book'),
+                View(gettext(u'Import Books'), 'books.import_csv'),
                 View(gettext(u'List'), 'books.index'),
                 View(gettext(u'Search'), 'books.search'),
+                Separator(),
+                View(gettext(u'Rented books'), 'rentals.out'),
+                View(gettext(u'Usage'), 'rentals.usage'),
             ),
             Subgroup(
-                current_user.username,
+                username,
                 View(gettext(u'Add user'), 'auth.register'),
+                View(gettext(u'Import users'), 'auth.provision'),
                 View(gettext(u'User list'), 'auth.userlist'),
-                View(gettext(u'Show Barcde'), 'auth.barcode',userid=current_user.id),
-                View(gettext(u'Edit password'), 'auth.edit',userid=current_user.id),
+                UserView(gettext(u'Show Barcde'), 'auth.barcode',userid=userid),
+                UserView(gettext(u'Edit password'), 'auth.edit',userid=userid),
                 Separator(),
                 View(gettext(u'Logout'),'user.logout'),
             ),
@@ -48,9 +70,9 @@ def mynavbar():
                 View(gettext(u'Search'), 'books.search'),
             ),
             Subgroup(
-                current_user.username,
-                View(gettext(u'Show Barcde'), 'auth.barcode', userid=current_user.id),
-                View(gettext(u'Edit password'), 'auth.edit', userid=current_user.id),
+                username,
+                UserView(gettext(u'Show Barcde'), 'auth.barcode', userid=userid),
+                UserView(gettext(u'Edit password'), 'auth.edit', userid=userid),
                 Separator(),
                 View(gettext(u'Logout'),'user.logout'),
             ),
@@ -58,3 +80,45 @@ def mynavbar():
 
     return navbar
 
+
+def navbar_role():
+    if current_user.is_anonymous:
+        return 'anonymous'
+    elif current_user.has_roles('Admin'):
+        return 'admin'
+    return 'user'
+
+
+@nav.navigation()
+def mynavbar():
+    if current_user.is_anonymous:
+        return build_navbar('anonymous')
+    return build_navbar(navbar_role(), current_user.username, current_user.id)
+
+
+# Rendered navbars, keyed by everything but the current user they depend on
+navbar_cache = {}
+
+def navbar_processor():
+    def render_navbar():
+        """
+        Render the navbar from the cache, only substituting the username and id
+        """
+        role = navbar_role()
+        own_page = role != 'anonymous' and \
+            (request.view_args or {}).get('userid') == current_user.id
+        key = (role, str(get_locale()), request.endpoint,
+               request.url_rule.rule if request.url_rule else None, own_page)
+        html = navbar_cache.get(key)
+        if html is None:
+            html = navbar_cache[key] = str(build_navbar(role).render())
+        if role != 'anonymous':
+            html = html.replace(USERNAME, escape(current_user.username)) \
+                       .replace(str(USERID), str(current_user.id))
+        return Markup(html)
+    return dict(render_navbar=render_navbar)
+
+
+def init_app(app):
+    nav.init_app(app)
+    app.context_processor(navbar_processor)
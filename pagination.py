@@ -0,0 +1,166 @@
+from flask import Response, current_app, request, stream_with_context, url_for
+from flask_table import Table
+from markupsafe import Markup
+from sqlalchemy import and_, or_
+from collections import namedtuple
+from itertools import chain, islice
+import datetime
+
+cursor_args = ('before', 'before_id', 'after', 'after_id')
+pagination_args = ('sort', 'direction') + cursor_args
+
+def page_args():
+    """
+    Return the url_for arguments of the current page, without its sort and cursor
+    """
+    args = dict((key, value) for key, value in request.args.items()
+                if key not in pagination_args)
+    args.update(request.view_args)
+    return args
+
+def all_url():
+    """
+    Return the url of the current listing showing all its items at once
+    """
+    args = dict((key, value) for key, value in request.args.items()
+                if key not in cursor_args)
+    args.update(request.view_args)
+    args['all'] = 1
+    return url_for(request.endpoint, **args)
+
+
+class SortableTable(Table):
+    """
+    Table whose headers sort the current page
+    """
+    allow_sort = True
+
+    def sort_url(self, col_key, reverse=False):
+        args = page_args()
+        args['sort'] = col_key
+        if reverse:
+            args['direction'] = 'desc'
+        return url_for(request.endpoint, **args)
+
+
+def sort_args(columns, default):
+    """
+    Return the (sort name, reverse) of the request
+    """
+    sort = request.args.get('sort', default)
+    if sort not in columns:
+        sort = default
+    return sort, request.args.get('direction') == 'desc'
+
+
+def cursor_type(column):
+    """
+    Return the function reading a value of column from a cursor of the URL
+    """
+    python_type = column.type.python_type
+    if python_type is datetime.datetime:
+        return datetime.datetime.fromisoformat
+    return python_type
+
+
+Page = namedtuple('Page', ['items', 'sort', 'reverse', 'prev_url', 'next_url'])
+
+def paginate(qry, columns, default, key, per_page):
+    """
+    Return one page of the items of qry, using keyset pagination on
+    (sort column, key) so that the cost of a page does not depend on how
+    deep into the table it is. columns maps the sort names of the request to
+    their column, key is a unique column breaking ties.
+    """
+    sort, reverse = sort_args(columns, default)
+    column = columns[sort]
+
+    # A 'before' cursor walks the table backward, an 'after' cursor forward
+    key_type = key.type.python_type
+    backward = request.args.get('before_id', type=key_type) is not None
+    prefix = 'before' if backward else 'after'
+    cursor_id = request.args.get(prefix + '_id', type=key_type)
+    cursor_value = request.args.get(prefix, '', type=cursor_type(column))
+    descending = reverse != backward
+
+    if cursor_id is not None:
+        if column is key:
+            qry = qry.filter(key < cursor_id if descending else key > cursor_id)
+        elif descending:
+            qry = qry.filter(or_(column < cursor_value,
+                                 and_(column == cursor_value, key < cursor_id)))
+        else:
+            qry = qry.filter(or_(column > cursor_value,
+                                 and_(column == cursor_value, key > cursor_id)))
+    if descending:
+        qry = qry.order_by(column.desc(), key.desc())
+    else:
+        qry = qry.order_by(column, key)
+
+    # The sort value is fetched along with each item to build the cursors
+    rows = qry.add_columns(column).limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows.reverse()
+    has_prev = more if backward else cursor_id is not None
+    has_next = True if backward else more
+
+    def page_url(direction, row):
+        item, value = row
+        args = page_args()
+        if sort != default:
+            args['sort'] = sort
+        if column is not key:
+            args[direction] = value
+        if reverse:
+            args['direction'] = 'desc'
+        args[direction + '_id'] = getattr(item, key.key)
+        return url_for(request.endpoint, **args)
+
+    prev_url = page_url('before', rows[0]) if rows and has_prev else None
+    next_url = page_url('after', rows[-1]) if rows and has_next else None
+    return Page([item for item, value in rows], sort, reverse, prev_url, next_url)
+
+
+def sorted_items(qry, columns, default, key, batch_size):
+    """
+    Return the (batches, sort, reverse) of all the items of qry, sorted like
+    paginate does. Batches are lists of items fetched with yield_per, the
+    first one is read before returning, and is None if there are no items.
+    """
+    sort, reverse = sort_args(columns, default)
+    column = columns[sort]
+    if reverse:
+        qry = qry.order_by(column.desc(), key.desc())
+    else:
+        qry = qry.order_by(column, key)
+
+    rows = iter(qry.yield_per(batch_size))
+    batches = iter(lambda: list(islice(rows, batch_size)), [])
+    first = next(batches, None)
+    if first is None:
+        return None, sort, reverse
+    return chain([first], batches), sort, reverse
+
+def stream_table(table, batches):
+    """
+    Yield the HTML of a flask_table table over batches of items, one chunk
+    per batch, so that the top of a large table is sent before its bottom
+    is even read
+    """
+    attrs = ''.join(' {}="{}"'.format(Markup.escape(name), Markup.escape(value))
+                    for name, value in sorted(table.get_html_attrs().items()))
+    yield Markup('<table{}>\n{}\n<tbody>\n'.format(attrs, table.thead()))
+    for batch in batches:
+        yield Markup('\n'.join(table.tr(item) for item in batch) + '\n')
+    yield Markup('</tbody>\n</table>')
+
+def stream_template(template_name, **context):
+    """
+    Render a template as a streamed response, each iterable of chunks in
+    the context being sent as it is read
+    """
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    return Response(stream_with_context(template.generate(context)))
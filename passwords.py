@@ -0,0 +1,125 @@
+# Password hashing in a bounded pool of processes, so that a burst of logins
+# neither holds the request threads on the CPU nor queues without limit
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from flask import g
+from flask_user.password_manager import PasswordManager
+from itertools import repeat
+from passlib.context import CryptContext
+from threading import BoundedSemaphore, Lock
+from werkzeug.exceptions import ServiceUnavailable
+
+# CryptContext of a worker process
+_context = None
+
+def _init_worker(schemes, keywords):
+    global _context
+    _context = CryptContext(schemes=schemes, **keywords)
+
+def _call(method, *args):
+    return getattr(_context, method)(*args)
+
+def _hash(password, rounds):
+    return with_rounds(_context, rounds).hash(password)
+
+
+def with_rounds(context, rounds):
+    """
+    Return a copy of context hashing at the given cost, context itself if
+    rounds is None
+    """
+    if rounds is None:
+        return context
+    scheme = context.default_scheme()
+    return context.copy(**dict(('{}__{}_rounds'.format(scheme, name), rounds)
+                               for name in ('default', 'min', 'max')))
+
+
+class PasswordHashingBusy(ServiceUnavailable):
+    description = 'Too many logins at once, please try again in a few seconds.'
+
+
+class PoolPasswordManager(PasswordManager):
+    """
+    Flask-User password manager hashing and verifying the passwords in a
+    pool of PASSWORD_HASH_PROCESSES processes, started on first use. At most
+    PASSWORD_HASH_QUEUE hashings wait for a process, the next ones fail at
+    once with a 503 Service Unavailable.
+    """
+
+    def __init__(self, app):
+        PasswordManager.__init__(self, app)
+        self.processes = app.config['PASSWORD_HASH_PROCESSES']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self.slots = BoundedSemaphore(app.config['PASSWORD_HASH_QUEUE'])
+        self.executor = None
+        self.lock = Lock()
+
+    def pool(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.processes, initializer=_init_worker,
+                    initargs=(self.user_manager.USER_PASSLIB_CRYPTCONTEXT_SCHEMES,
+                              self.user_manager.USER_PASSLIB_CRYPTCONTEXT_KEYWORDS))
+            return self.executor
+
+    def run(self, method, *args):
+        """
+        Call a method of the CryptContext in the pool, or in this process if
+        PASSWORD_HASH_PROCESSES is 0
+        """
+        if self.processes == 0:
+            return getattr(self.password_crypt_context, method)(*args)
+
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHashingBusy(retry_after=5)
+        try:
+            future = self.pool().submit(_call, method, *args)
+            try:
+                return future.result(self.timeout)
+            except TimeoutError:
+                # Drop the hashing if it is still waiting for a process
+                future.cancel()
+                raise PasswordHashingBusy(retry_after=5)
+        except BrokenProcessPool:
+            # A worker died, start a new pool for the next requests
+            with self.lock:
+                self.executor = None
+            raise
+        finally:
+            self.slots.release()
+
+    def hash_password(self, password):
+        return self.run('hash', password)
+
+    def hash_passwords(self, passwords, rounds=None):
+        """
+        Hash a list of passwords, spread over every process of the pool, at
+        the cost rounds rather than the configured one if given. Meant for
+        bulk jobs: it does not wait for a slot of the queue, and the logins
+        made meanwhile wait behind it.
+        """
+        if self.processes == 0:
+            context = with_rounds(self.password_crypt_context, rounds)
+            return [context.hash(password) for password in passwords]
+        return list(self.pool().map(_hash, passwords, repeat(rounds), chunksize=8))
+
+    def verify_password(self, password, password_hash):
+        """
+        Verify password, keeping a new hash of it in g if password_hash was
+        made with other settings, see rehashed_password
+        """
+        valid, new_hash = self.run('verify_and_update', password, password_hash)
+        if valid and new_hash:
+            g.rehashed_password = (password_hash, new_hash)
+        return valid
+
+
+def rehashed_password(password_hash):
+    """
+    Return the new hash of the password verified with password_hash during
+    this request, if it was made with other settings than the current ones
+    """
+    old_hash, new_hash = g.pop('rehashed_password', (None, None))
+    return new_hash if old_hash == password_hash else None
@@ -0,0 +1,164 @@
+from app import db
+from flask import Blueprint, current_app, render_template, request
+from flask_wtf import FlaskForm
+from wtforms import SubmitField, validators
+from wtforms.fields.html5 import DateField
+from flask_table import Table, Col, DatetimeCol, LinkCol
+from flask_babelex import lazy_gettext as _l
+from flask_user import roles_required
+from werkzeug.exceptions import abort
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from auth import User
+from books import Book, CategoryCol, Rental, Title
+from exports import export_file, export_formats, export_response
+from pagination import SortableTable, paginate
+import click
+import datetime
+
+bp = Blueprint('rentals', __name__, url_prefix='/rentals')
+
+
+class RentalTable(SortableTable):
+    classes = ['table']
+    id = Col('Id', show=False)
+    title = Col(_l(u'Title'), attr='book.title_record.title', allow_sort=False)
+    renter = LinkCol(_l(u'Renter'), '.user', url_kwargs=dict(userid='user_id'),
+                     attr='user.username', allow_sort=False)
+    category = CategoryCol(_l(u'Category'), allow_sort=False)
+    checkout_time = DatetimeCol(_l(u'Rented time'))
+    return_time = DatetimeCol(_l(u'Return time'), allow_sort=False)
+
+
+class UsageTable(Table):
+    classes = ['table']
+    category = CategoryCol(_l(u'Category'))
+    rentals = Col(_l(u'Rentals'))
+
+
+class OverdueForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    overdue_since = DateField(_l(u'Overdue since'), [validators.Optional()])
+    submit = SubmitField(_l(u'Filter'))
+
+
+class PeriodForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    start = DateField(_l(u'From'), [validators.Optional()])
+    end = DateField(_l(u'To'), [validators.Optional()])
+    submit = SubmitField(_l(u'Filter'))
+
+
+# The rentals are listed in the order they were made
+rental_sort_columns = {
+    'checkout_time': Rental.checkout_time,
+}
+
+def rentals_page(qry):
+    """
+    Return one page of the rentals of qry, with their book, its title and
+    their user
+    """
+    qry = qry.options(joinedload(Rental.book).joinedload(Book.title_record),
+                      joinedload(Rental.user))
+    return paginate(qry, rental_sort_columns, 'checkout_time', Rental.id,
+                    current_app.config['BOOKS_PER_PAGE'])
+
+def day_start(day):
+    return datetime.datetime.combine(day, datetime.time())
+
+def in_period(qry, start=None, end=None):
+    """
+    Filter qry on the rentals made from the start day to the end day
+    included
+    """
+    if start:
+        qry = qry.filter(Rental.checkout_time >= day_start(start))
+    if end:
+        qry = qry.filter(Rental.checkout_time < day_start(end) + datetime.timedelta(days=1))
+    return qry
+
+@bp.route('/')
+@roles_required('Admin')
+def out():
+    """
+    Books currently rented, oldest rental first, or only the ones overdue
+    on a given day
+    """
+    form = OverdueForm(request.args)
+    qry = Rental.query.filter(Rental.return_time.is_(None))
+    # Invalid dates are ignored
+    if form.validate() and form.overdue_since.data:
+        due = day_start(form.overdue_since.data) - \
+            datetime.timedelta(days=current_app.config['RENTAL_LOAN_DAYS'])
+        qry = qry.filter(Rental.checkout_time < due)
+
+    page = rentals_page(qry)
+    table = RentalTable(page.items, sort_by=page.sort, sort_reverse=page.reverse,
+                        no_items=_l(u'No books out'))
+    return render_template('rentals/out.html', table=table, form=form, page=page)
+
+@bp.route('/user/<uuid:userid>')
+@roles_required('Admin')
+def user(userid):
+    """
+    Rental history of a user
+    """
+    username = db.session.query(User.username).filter(User.id == userid).scalar()
+    if username is None:
+        abort(404)
+    page = rentals_page(Rental.query.filter(Rental.user_id == userid))
+    table = RentalTable(page.items, sort_by=page.sort, sort_reverse=page.reverse,
+                        no_items=_l(u'No rentals'))
+    return render_template('rentals/user.html', table=table, page=page, username=username)
+
+@bp.route('/usage')
+@roles_required('Admin')
+def usage():
+    """
+    Number of rentals of each category over a period
+    """
+    form = PeriodForm(request.args)
+    form.validate()
+    qry = in_period(db.session.query(Rental.category, func.count().label('rentals')),
+                    form.start.data, form.end.data)
+    table = UsageTable(qry.group_by(Rental.category).order_by(Rental.category).all(),
+                       no_items=_l(u'No rentals'))
+    return render_template('rentals/usage.html', table=table, form=form)
+
+
+def export_query(start=None, end=None):
+    qry = db.session.query(Rental.id, Rental.book_id, Title.isbn13, Title.title,
+                           Rental.user_id, User.username, Rental.category,
+                           Rental.checkout_time, Rental.return_time) \
+        .join(Book, Book.id == Rental.book_id) \
+        .join(Title, Title.id == Book.title_id) \
+        .join(User, User.id == Rental.user_id)
+    return in_period(qry, start, end).order_by(Rental.id)
+
+@bp.route('/export.<any(csv, ndjson):fmt>')
+@roles_required('Admin')
+def export(fmt):
+    """
+    Download the rental history, or the rentals made over a period, as CSV
+    or NDJSON
+    """
+    form = PeriodForm(request.args)
+    form.validate()
+    return export_response(export_query(form.start.data, form.end.data), fmt, 'rentals')
+
+@bp.cli.command('export')
+@click.option('--format', 'fmt', type=click.Choice(sorted(export_formats)), default='csv')
+@click.option('--from', 'start', type=click.DateTime(['%Y-%m-%d']),
+              help='First day of the rentals exported.')
+@click.option('--to', 'end', type=click.DateTime(['%Y-%m-%d']),
+              help='Last day of the rentals exported.')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-',
+              help='File the rentals are written to, standard output by default.')
+def export_command(fmt, start, end, output):
+    """Export the rental history."""
+    export_file(export_query(start, end), fmt, output)
@@ -0,0 +1,278 @@
+from app import db
+from sqlalchemy import Float, Integer, column, literal_column, select, table, text
+from sqlalchemy.exc import OperationalError
+from bisect import bisect_left, insort
+from collections import Counter
+from threading import Lock
+import re
+import unicodedata
+
+# Whether the FTS5 index exists, None until checked. Other backends (or
+# SQLite builds without FTS5) fall back to LIKE queries.
+fts_enabled = None
+
+titles_fts = table('titles_fts', column('rowid', Integer), column('rank', Float))
+
+fts_columns = 'title, author, publisher, isbn13, category'
+
+fts_exists = text("SELECT 1 FROM sqlite_master WHERE type='table' AND name='titles_fts'")
+
+fts_schema = [
+    """
+    CREATE VIRTUAL TABLE titles_fts USING fts5(
+        {columns}, content='titles', content_rowid='id')
+    """,
+    """
+    CREATE TRIGGER titles_fts_insert AFTER INSERT ON titles BEGIN
+        INSERT INTO titles_fts(rowid, {columns})
+        VALUES (new.id, new.title, new.author, new.publisher, new.isbn13, new.category);
+    END
+    """,
+    """
+    CREATE TRIGGER titles_fts_delete AFTER DELETE ON titles BEGIN
+        INSERT INTO titles_fts(titles_fts, rowid, {columns})
+        VALUES ('delete', old.id, old.title, old.author, old.publisher, old.isbn13, old.category);
+    END
+    """,
+    """
+    CREATE TRIGGER titles_fts_update AFTER UPDATE OF {columns} ON titles BEGIN
+        INSERT INTO titles_fts(titles_fts, rowid, {columns})
+        VALUES ('delete', old.id, old.title, old.author, old.publisher, old.isbn13, old.category);
+        INSERT INTO titles_fts(rowid, {columns})
+        VALUES (new.id, new.title, new.author, new.publisher, new.isbn13, new.category);
+    END
+    """,
+    "INSERT INTO titles_fts(titles_fts) VALUES ('rebuild')",
+]
+
+
+def create_search_index():
+    """
+    Create the SQLite FTS5 index of the titles table, along with the triggers
+    keeping it in sync with every insert, update and delete of a title
+    """
+    global fts_enabled
+    if db.engine.dialect.name != 'sqlite':
+        return
+
+    with db.engine.begin() as conn:
+        if not conn.execute(fts_exists).first():
+            try:
+                for statement in fts_schema:
+                    conn.execute(text(statement.format(columns=fts_columns)))
+            except OperationalError:
+                # SQLite was built without FTS5
+                return
+    fts_enabled = True
+
+
+def has_fts_index():
+    """
+    Return whether the FTS5 index exists, checking the database once
+    """
+    global fts_enabled
+    if fts_enabled is None:
+        fts_enabled = db.engine.dialect.name == 'sqlite' and \
+            db.session.execute(fts_exists).first() is not None
+    return fts_enabled
+
+
+def search_words(search_string):
+    """
+    Split a search string into the words to look for
+    """
+    return re.findall(r'\w+', search_string or '')
+
+
+def fts_match(words):
+    """
+    Return a (rowid, rank) subquery of the titles matching any of the words,
+    each word also matching as a prefix, or None without a full-text index.
+    Lower ranks are better matches.
+    """
+    if not has_fts_index():
+        return None
+    query = ' OR '.join('"{}"*'.format(word) for word in words)
+    return select([titles_fts.c.rowid, titles_fts.c.rank]) \
+        .where(literal_column('titles_fts').match(query)) \
+        .alias('matches')
+
+
+def normalize(value):
+    """
+    Lower case and strip the accents of a value so that 'eco' matches 'École'
+    """
+    value = unicodedata.normalize('NFKD', value.lower())
+    return ''.join(char for char in value if not unicodedata.combining(char))
+
+
+class PrefixIndex(object):
+    """
+    In-memory index of the titles, authors and publishers of the books, kept
+    as a sorted array of (key, field, value) entries searched with bisect.
+    Each value gets one entry per word it contains so that 'prince' also
+    suggests 'Le Petit Prince'.
+    """
+    fields = ('title', 'author', 'publisher')
+
+    def __init__(self):
+        self.entries = []
+        self.counts = Counter()
+        self.lock = Lock()
+
+    def _entries(self, field, value):
+        words = search_words(normalize(value))
+        for i in range(len(words)):
+            yield (' '.join(words[i:]), field, value)
+
+    def values(self, book):
+        """
+        Return the (field, value) pairs of a book to index
+        """
+        return [(field, getattr(book, field)) for field in self.fields
+                if getattr(book, field)]
+
+    def build(self, books):
+        """
+        Rebuild the whole index from an iterable of books
+        """
+        counts = Counter()
+        for book in books:
+            for field, value in self.values(book):
+                counts[(field, value)] += 1
+        entries = sorted(entry for field, value in counts
+                         for entry in self._entries(field, value))
+        with self.lock:
+            self.entries = entries
+            self.counts = counts
+
+    def add(self, values):
+        with self.lock:
+            for field, value in values:
+                self.counts[(field, value)] += 1
+                if self.counts[(field, value)] == 1:
+                    for entry in self._entries(field, value):
+                        insort(self.entries, entry)
+
+    def remove(self, values):
+        with self.lock:
+            for field, value in values:
+                self.counts[(field, value)] -= 1
+                if self.counts[(field, value)] <= 0:
+                    del self.counts[(field, value)]
+                    for entry in self._entries(field, value):
+                        i = bisect_left(self.entries, entry)
+                        if i < len(self.entries) and self.entries[i] == entry:
+                            del self.entries[i]
+
+    def suggest(self, prefix, limit=10):
+        """
+        Return up to limit distinct (field, value) pairs having a word
+        starting with prefix
+        """
+        prefix = ' '.join(search_words(normalize(prefix)))
+        if not prefix:
+            return []
+        results = []
+        with self.lock:
+            i = bisect_left(self.entries, (prefix,))
+            while i < len(self.entries) and len(results) < limit:
+                key, field, value = self.entries[i]
+                if not key.startswith(prefix):
+                    break
+                if (field, value) not in results:
+                    results.append((field, value))
+                i += 1
+        return results
+
+
+suggestions = PrefixIndex()
+
+
+def trigrams(word):
+    """
+    Return the trigrams of a word, padded like pg_trgm does
+    """
+    padded = '  ' + word + ' '
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class TrigramIndex(object):
+    """
+    In-memory trigram index of the words of the titles, authors and
+    publishers of the books, used for typo tolerant searches. Trigrams map to
+    the words containing them and words map to the books containing them, so
+    a query only compares its words with the (small) vocabulary.
+    """
+
+    def __init__(self):
+        self.grams = {}
+        self.vocabulary = {}
+        self.lock = Lock()
+
+    def _words(self, values):
+        return set(word for field, value in values
+                   for word in search_words(normalize(value)))
+
+    def build(self, books):
+        """
+        Rebuild the whole index from an iterable of books having an id
+        """
+        index = TrigramIndex()
+        for book in books:
+            index.add(book.id, suggestions.values(book))
+        with self.lock:
+            self.grams = index.grams
+            self.vocabulary = index.vocabulary
+
+    def add(self, book_id, values):
+        with self.lock:
+            for word in self._words(values):
+                if word not in self.vocabulary:
+                    grams = trigrams(word)
+                    self.vocabulary[word] = (len(grams), set())
+                    for gram in grams:
+                        self.grams.setdefault(gram, set()).add(word)
+                self.vocabulary[word][1].add(book_id)
+
+    def remove(self, book_id, values):
+        with self.lock:
+            for word in self._words(values):
+                if word not in self.vocabulary:
+                    continue
+                books = self.vocabulary[word][1]
+                books.discard(book_id)
+                if not books:
+                    del self.vocabulary[word]
+                    for gram in trigrams(word):
+                        self.grams[gram].discard(word)
+                        if not self.grams[gram]:
+                            del self.grams[gram]
+
+    def search(self, search_string, threshold=0.3, limit=200):
+        """
+        Return up to limit (book id, score) pairs, best first. A book scores
+        the trigram similarity of its closest word for every searched word
+        having a close enough word in the book.
+        """
+        scores = Counter()
+        with self.lock:
+            for word in set(search_words(normalize(search_string))):
+                grams = trigrams(word)
+                shared = Counter()
+                for gram in grams:
+                    shared.update(self.grams.get(gram, ()))
+                best = {}
+                for candidate, count in shared.items():
+                    length, books = self.vocabulary[candidate]
+                    similarity = count / float(len(grams) + length - count)
+                    if similarity < threshold:
+                        continue
+                    for book_id in books:
+                        if similarity > best.get(book_id, 0):
+                            best[book_id] = similarity
+                scores.update(best)
+        return scores.most_common(limit)
+
+
+fuzzy_index = TrigramIndex()